@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Импорт заявок из NDJSON (JSON-объект на строку) в CRM
+
+Запуск:
+  python import_repairs.py repairs.ndjson --base-url http://127.0.0.1:8001
+  cat repairs.ndjson | python import_repairs.py - --base-url http://127.0.0.1:8001
+  python import_repairs.py repairs.ndjson --direct   # сервер остановлен: запись прямо в хранилище
+
+Файл отправляется и разбирается потоково, поэтому размер не ограничен памятью.
+Заявки с уже известным id пропускаются — прерванный импорт можно повторить.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+UPLOAD_PIECE = 1024 * 1024
+
+
+def upload_pieces(stream, total: int | None):
+    """Куски файла для отправки с выводом прогресса"""
+    sent = 0
+    started = time.time()
+    reported = 0.0
+    while True:
+        piece = stream.read(UPLOAD_PIECE)
+        if not piece:
+            break
+        sent += len(piece)
+        now = time.time()
+        if now - reported >= 1:
+            reported = now
+            done = f"{sent / total:.0%}" if total else f"{sent // (1024 * 1024)} МБ"
+            print(f"📤 Отправлено {done} ({sent / max(now - started, 0.001) / 1024 / 1024:.1f} МБ/с)", file=sys.stderr)
+        yield piece
+
+
+def import_over_http(stream, total: int | None, base_url: str) -> dict:
+    parts = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = connection_class(parts.hostname, parts.port, timeout=600)
+    path = (parts.path.rstrip("/") or "") + "/api/repairs/import"
+    headers = {"Content-Type": "application/x-ndjson"}
+    if total is not None:
+        headers["Content-Length"] = str(total)
+    else:
+        headers["Transfer-Encoding"] = "chunked"
+    conn.request("POST", path, body=upload_pieces(stream, total), headers=headers,
+                 encode_chunked=total is None)
+    resp = conn.getresponse()
+    raw = resp.read().decode("utf-8")
+    conn.close()
+    result = json.loads(raw) if raw else {}
+    if resp.status >= 400:
+        raise RuntimeError(result.get("error") or f"HTTP {resp.status}")
+    return result
+
+
+def read_lines(stream, max_line: int):
+    """Строки файла; строка длиннее max_line отдаётся как None и не читается в память целиком"""
+    while True:
+        line = stream.readline(max_line + 1)
+        if not line:
+            return
+        if len(line) > max_line and not line.endswith(b"\n"):
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_line + 1)
+            yield None
+            continue
+        yield line
+
+
+def import_direct(stream, chunk_size: int | None) -> dict:
+    """Импорт в хранилище без сервера (тот же STORAGE_BACKEND/файлы, что у production_server.py)"""
+    import production_server as server
+
+    server.load_all()
+
+    def progress(report):
+        print(f"📥 {report['processed']} строк: создано {report['created']}, "
+              f"пропущено {report['skipped']}, ошибок {report['failed']}", file=sys.stderr)
+
+    try:
+        return server.import_repairs(read_lines(stream, server.IMPORT_MAX_LINE), chunk_size or server.IMPORT_CHUNK_SIZE, progress)
+    finally:
+        # полная запись всех коллекций (в журнальном режиме — чекпоинт)
+        server.checkpoint_all()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="файл NDJSON или - для stdin")
+    parser.add_argument("--base-url", type=str, default="http://127.0.0.1:8001")
+    parser.add_argument("--direct", action="store_true", help="писать прямо в хранилище (сервер должен быть остановлен)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="заявок в одной фиксации при --direct")
+    args = parser.parse_args()
+
+    if args.path == "-":
+        stream, total = sys.stdin.buffer, None
+    else:
+        stream, total = open(args.path, "rb"), os.path.getsize(args.path)
+    try:
+        if args.direct:
+            report = import_direct(stream, args.chunk_size)
+        else:
+            report = import_over_http(stream, total, args.base_url)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"❌ Импорт не выполнен: {e}", file=sys.stderr)
+        return 2
+    finally:
+        stream.close()
+
+    for error in report.get("errors", []):
+        print(f"⚠️ Строка {error['line']}: {error['error']}", file=sys.stderr)
+    print(f"✅ Обработано строк: {report.get('processed', 0)}, создано: {report.get('created', 0)}, "
+          f"пропущено: {report.get('skipped', 0)}, ошибок: {report.get('failed', 0)}")
+    return 0 if not report.get("failed") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
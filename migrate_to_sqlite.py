@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Однократный перенос данных CRM из *_data.json в SQLite
+
+Запуск:
+  python migrate_to_sqlite.py --db crm_data.sqlite3
+  STORAGE_BACKEND=sqlite python production_server.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+
+import production_server as server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", type=str, default=server.SQLITE_FILE)
+    parser.add_argument("--force", action="store_true", help="перезаписать коллекции, уже перенесённые в базу")
+    args = parser.parse_args()
+
+    source = server.JsonFileStorage()
+    target = server.SqliteStorage(args.db)
+    migrated = 0
+    try:
+        for collection in server.COLLECTIONS:
+            data = source.load(collection)
+            if data is None:
+                print(f"⏭️ {collection}: файл не найден, пропуск")
+                continue
+            if target.load(collection) is not None and not args.force:
+                print(f"⏭️ {collection}: уже есть в {args.db} (используйте --force)")
+                continue
+            if not target.save_all(collection, data):
+                return 2
+            migrated += 1
+            print(f"✅ {collection}: перенесено {len(data)}")
+        # последовательность изменений продолжается с границы, выданной при работе на JSON
+        target.save_change_seq(max(target.load_change_seq(), source.load_change_seq()))
+    finally:
+        target.close()
+
+    print(f"📦 Готово: {migrated} коллекций в {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
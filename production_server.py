@@ -6,201 +6,2366 @@ Production-ready сервер для TechRepair CRM
 """
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import parse_qs, urlsplit
+from collections import Counter, OrderedDict, deque
+import bisect
+import csv
+import hashlib
+import heapq
+import re
+import http.client
+import asyncio
+import io
 import json
 import os
 import uuid
 from datetime import datetime
 import threading
+import queue
+import signal
+import socket
+import sqlite3
+import time
+import zlib
 
 # Файл для хранения заявок
 DATA_FILE = 'repairs_data.json'
-LOCK = threading.Lock()
+# Блокировки по коллекциям: писатели разных коллекций не ждут друг друга.
+# Несколько блокировок берутся только в порядке COLLECTION_NAMES (заявки раньше клиентов).
+# RLock: save_*() и record_change() вызываются и под уже взятой блокировкой коллекции.
+COLLECTION_NAMES = ("repairs", "customers", "inventory", "appointments", "settings")
+LOCKS = {name: threading.RLock() for name in COLLECTION_NAMES}
+# Последовательность изменений, ревизии и рассылка событий: короткая секция без ввода-вывода,
+# берётся последней (внутри блокировки коллекции), никогда наоборот
+CHANGE_LOCK = threading.Lock()
+
+
+class RecordList:
+    """Записи коллекции, новые первыми, поверх словаря id -> запись.
+
+    Словарь хранит записи в порядке добавления, а обход идёт с конца, поэтому
+    добавление и удаление по id — O(1): без сдвига списка и поиска записи сравнением.
+
+    Для читателей рядом лежат копии записей (copy-on-write) в том же порядке:
+    писатель только помечает изменённую запись (touch), а frozen() копирует
+    заново лишь помеченные — срез после записи не копирует всю коллекцию.
+    """
+
+    def __init__(self, items=()):
+        # items — как в файле данных, новые первыми
+        self.index = {item.get("id"): item for item in reversed(items)}
+        # id -> копия для читателей (None — ещё не снята); устаревшие копии, порядок не важен
+        self.published = dict.fromkeys(self.index)
+        self.stale = dict.fromkeys(self.index)
+
+    def __iter__(self):
+        return reversed(self.index.values())
+
+    def __reversed__(self):
+        return iter(self.index.values())
+
+    def __len__(self):
+        return len(self.index)
+
+    def insert(self, item):
+        """Добавляет запись в начало"""
+        self.index.pop(item["id"], None)
+        self.index[item["id"]] = item
+        self.published.pop(item["id"], None)
+        self.published[item["id"]] = None
+        self.stale[item["id"]] = None
+
+    def extend(self, items):
+        """Добавляет записи так же, как поочерёдные insert (последняя — первой)"""
+        for item in items:
+            self.insert(item)
+
+    def remove(self, item_id):
+        """Удаляет запись по id, возвращает удалённую или None"""
+        self.published.pop(item_id, None)
+        return self.index.pop(item_id, None)
+
+    def touch(self, item_id):
+        """Запись изменена на месте: её копия для читателей устарела"""
+        if item_id in self.published:
+            self.stale[item_id] = None
+
+    def touch_all(self):
+        # update из готового словаря не прерывается другими потоками, в отличие от цикла
+        self.stale.update(dict.fromkeys(list(self.index)))
+
+    def frozen(self, view=dict):
+        """Кортеж копий записей, новые первыми; заново снимаются только помеченные копии.
+
+        Вызывать под блокировкой коллекции. view строит копию из записи — одна и та же
+        функция при каждом вызове (у клиентов копия дополняется сводкой по заявкам).
+        """
+        stale, self.stale = self.stale, {}
+        for item_id in stale:
+            item = self.index.get(item_id)
+            if item is not None:
+                self.published[item_id] = view(item)
+        return tuple(reversed(self.published.values()))
+
 
 # Глобальное хранилище заявок
-REPAIRS_STORAGE = []
+REPAIRS_STORAGE = RecordList()
 
 # Доп. хранилища для CRM
 CUSTOMERS_FILE = 'customers_data.json'
 INVENTORY_FILE = 'inventory_data.json'
 APPOINTMENTS_FILE = 'appointments_data.json'
 SETTINGS_FILE = 'settings_data.json'
+# Верхняя граница выданных номеров последовательности изменений
+CHANGE_SEQ_FILE = 'change_seq.json'
+
+CUSTOMERS_STORAGE = RecordList()
+INVENTORY_STORAGE = RecordList()
+APPOINTMENTS_STORAGE = RecordList()
+SETTINGS_STORAGE = {}
+
+# Индексы id -> запись: словари самих RecordList
+REPAIRS_INDEX = REPAIRS_STORAGE.index
+CUSTOMERS_INDEX = CUSTOMERS_STORAGE.index
+INVENTORY_INDEX = INVENTORY_STORAGE.index
+APPOINTMENTS_INDEX = APPOINTMENTS_STORAGE.index
+# Ключ клиента (нормализованный телефон или email) -> клиенты с этим ключом, новые первыми
+CUSTOMER_KEYS = {}
+# Ключ клиента -> {"repairs": {id заявки: timestamp}, "last": дата последней заявки}
+CUSTOMER_REPAIRS = {}
+# Счётчики для /api/stats: по статусу, срочности и дню создания
+REPAIR_STATS = {"status": Counter(), "urgency": Counter(), "day": Counter()}
+# Ревизии коллекций: растут при каждом изменении, из них строятся ETag списков и статистики.
+# BOOT_ID отличает ревизии разных запусков сервера.
+REVISIONS = Counter()
+REVISION_TIMES = {}
+BOOT_ID = uuid.uuid4().hex[:8]
+STARTED_AT = datetime.now().isoformat()
+# Глобальная последовательность изменений для /api/changes и id событий /api/events.
+# Номера выдаются блоками по CHANGE_SEQ_BLOCK: граница блока сохраняется в хранилище до выдачи
+# первого номера из него, после перезапуска (в том числе аварийного) счёт продолжается с неё —
+# последовательность растёт между запусками и не зависит от системных часов.
+# Начальные значения читаются из хранилища после create_storage().
+# CHANGE_LOG: (коллекция, id) -> (seq, op) последнего изменения, порядок вставки = порядок seq.
+CHANGE_SEQ_BLOCK = 100000
+CHANGE_SEQ = 0
+CHANGE_SEQ_LIMIT = 0
+CHANGE_BASE = 0
+CHANGE_LOG = {}
+DEFAULT_CHANGES_LIMIT = 1000
+MAX_CHANGES_LIMIT = 10000
+
+# Поток событий /api/events (Server-Sent Events)
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+EVENTS_CLIENT_BUFFER = int(os.environ.get('EVENTS_CLIENT_BUFFER', 256))
+# В режимах single/pool каждый клиент /api/events держит свой поток: сверх лимита — 503 (страница перейдёт на опрос)
+EVENTS_MAX_CLIENTS = int(os.environ.get('EVENTS_MAX_CLIENTS', 32))
+EVENTS_HISTORY = int(os.environ.get('EVENTS_HISTORY', 1000))
+
+# Сжатие ответов: gzip/deflate по Accept-Encoding для тел не меньше COMPRESS_MIN_SIZE байт
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+# wbits для zlib: 31 — gzip-обёртка, 15 — zlib-поток (HTTP "deflate")
+COMPRESS_WBITS = {"gzip": 31, "deflate": 15}
+
+# Групповая запись: изменённая коллекция сохраняется, когда PERSIST_WINDOW секунд не было новых
+# изменений, но не позже PERSIST_MAX_DELAY секунд после первого несохранённого; 0 — сохранять сразу
+PERSIST_WINDOW = float(os.environ.get('PERSIST_WINDOW', 0.2))
+PERSIST_MAX_DELAY = float(os.environ.get('PERSIST_MAX_DELAY', 2))
+
+# Кэш сериализованных ответов списков (байт, 0 — отключён)
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Статика: файлы не меньше STATIC_SENDFILE_MIN байт не кэшируются в памяти и отдаются через sendfile
+STATIC_SENDFILE_MIN = int(os.environ.get('STATIC_SENDFILE_MIN', 256 * 1024))
+
+# Выгрузка /api/repairs/export отдаётся кусками примерно такого размера
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Пакетные запросы /api/repairs/batch, /api/customers/batch: максимум записей в одном теле
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 10000))
+
+# Импорт NDJSON /api/repairs/import: заявок в одной фиксации, предел длины строки, сколько ошибок перечислять
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+IMPORT_MAX_LINE = 1024 * 1024
+IMPORT_MAX_ERRORS = 100
+
+# Журнальный режим: изменения дописываются в <файл>.log, снапшот переписывается только на чекпоинте
+STORAGE_JOURNAL = os.environ.get('STORAGE_JOURNAL', '0') == '1'
+JOURNAL_CHECKPOINT_EVERY = int(os.environ.get('JOURNAL_CHECKPOINT_EVERY', 1000))  # записей в журнале
+JOURNAL_CHECKPOINT_INTERVAL = float(os.environ.get('JOURNAL_CHECKPOINT_INTERVAL', 300))  # секунд
+JOURNAL_FSYNC = os.environ.get('JOURNAL_FSYNC', '0') == '1'
+
+_JOURNAL_HANDLES = {}
+_JOURNAL_COUNTS = {}
+# Файл -> блокировка его снапшота и журнала
+_FILE_LOCKS = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+# Загрузка коллекций: background — порт открывается сразу, данные догружаются в фоне,
+# lazy — только при первом обращении, eager — всё до открытия порта
+COLLECTIONS_LOAD = os.environ.get('COLLECTIONS_LOAD', 'background').strip().lower()
+
+# Бэкенд хранения: json (файлы *_data.json, по умолчанию) или sqlite
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json').strip().lower()
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'crm_data.sqlite3')
+
+
+# Последнее поле снапшота: sha256 всех байтов файла до значения суммы
+SNAPSHOT_CHECKSUM_FIELD = '"checksum": "sha256:'
+
+
+def _backup_path(path):
+    """Предыдущее поколение снапшота"""
+    return path + '.bak'
+
+
+def _encode_snapshot(data):
+    """JSON снапшота с контрольной суммой последним полем — файл остаётся обычным JSON"""
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if not isinstance(data, dict):
+        return text.encode('utf-8')
+    head = text[:-1].rstrip() + (',' if data else '') + '\n  ' + SNAPSHOT_CHECKSUM_FIELD
+    head = head.encode('utf-8')
+    return head + hashlib.sha256(head).hexdigest().encode('ascii') + b'"\n}\n'
+
+
+def _verify_snapshot(raw):
+    """True — сумма сошлась, False — файл повреждён, None — суммы нет (старый формат)"""
+    field = SNAPSHOT_CHECKSUM_FIELD.encode('utf-8')
+    pos = raw.rfind(field)
+    if pos < 0:
+        return None
+    start = pos + len(field)
+    return hashlib.sha256(raw[:start]).hexdigest().encode('ascii') == raw[start:start + 64]
+
+
+def _file_lock(path):
+    with _FILE_LOCKS_GUARD:
+        return _FILE_LOCKS.setdefault(path, threading.RLock())
+
+
+def _quarantine(path):
+    """Отодвигает отвергнутый снапшот в <path>.corrupt: ротация .bak при следующей записи его не затрёт"""
+    target = path + '.corrupt'
+    if os.path.exists(target):
+        target += datetime.now().strftime('-%Y%m%d-%H%M%S')
+    os.replace(path, target)
+    print(f"🚨 {path} не читается и перенесён в {target}")
+    return target
+
+
+def _check_snapshot_lost(path, rejected):
+    """Ни одно поколение снапшота не прочиталось (сейчас или при прошлом запуске) — RuntimeError.
+
+    Пустая коллекция вместо данных была бы записана поверх при первом же изменении.
+    """
+    if rejected or os.path.exists(path + '.corrupt'):
+        raise RuntimeError(f"{path}: снапшот и резервная копия не читаются (отложены в {path}.corrupt*); "
+                           f"восстановите файл из них или удалите их, чтобы начать коллекцию заново")
+
+
+def _load_json_file(path, default):
+    """Читает снапшот; если он не читается — предыдущее поколение <path>.bak.
+
+    Файл, который разбирается, но не сходится с контрольной суммой (правка руками),
+    загружается с предупреждением. Неразбираемый уходит в .corrupt; если не прочиталось
+    ни одно поколение — RuntimeError, а не пустая коллекция. default — только если снапшота нет.
+    """
+    rejected = []
+    for candidate in (path, path + '.tmp', _backup_path(path)):
+        if not os.path.exists(candidate):
+            continue
+        temporary = candidate.endswith('.tmp')
+        try:
+            with open(candidate, 'rb') as f:
+                raw = f.read()
+            verified = _verify_snapshot(raw)
+            # .tmp берётся, только если запись дошла до конца (сумма сошлась), но rename не успел
+            if temporary and not verified:
+                continue
+            data = json.loads(raw)
+        except Exception as e:
+            print(f"❌ Ошибка чтения {candidate}: {e}")
+            if not temporary:
+                rejected.append(_quarantine(candidate))
+            continue
+        if verified is False:
+            print(f"🚨 Контрольная сумма {candidate} не сошлась (файл правили вручную?) — загружен без проверки, "
+                  f"следующая запись сохранит его с новой суммой")
+        if candidate != path:
+            print(f"♻️ {path}: снапшот повреждён или отсутствует, загружен {candidate}")
+        if isinstance(data, dict):
+            data.pop("checksum", None)
+        return data
+    _check_snapshot_lost(path, rejected)
+    return default
+
+
+def _fsync_dir(path):
+    """fsync каталога, чтобы переименование пережило сбой питания (на Windows недоступно)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _save_json_file(path, data):
+    """Атомарная запись снапшота: временный файл + fsync + rename, прежний файл остаётся как .bak.
+
+    Журнал коллекции после этого больше не нужен. Сбой на любом шаге оставляет на диске
+    целый снапшот — новый, прежний или .bak, который _load_json_file подхватит сам.
+    """
+    try:
+        with _file_lock(path):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_encode_snapshot(data))
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.replace(path, _backup_path(path))
+            os.replace(tmp_path, path)
+            _fsync_dir(path)
+            _truncate_journal(path)
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка записи {path}: {e}")
+        return False
+
+
+def _journal_path(path):
+    return path + '.log'
+
+
+def _truncate_journal(path):
+    handle = _JOURNAL_HANDLES.pop(path, None)
+    if handle:
+        handle.close()
+    if os.path.exists(_journal_path(path)):
+        os.remove(_journal_path(path))
+    _JOURNAL_COUNTS[path] = 0
+
+
+def _append_journal(path, records):
+    """Дописывает компактные записи в журнал одной записью в файл, возвращает число записей в нём"""
+    with _file_lock(path):
+        handle = _JOURNAL_HANDLES.get(path)
+        if handle is None:
+            handle = _JOURNAL_HANDLES[path] = open(_journal_path(path), 'a', encoding='utf-8')
+        handle.write("".join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records))
+        handle.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(handle.fileno())
+        _JOURNAL_COUNTS[path] = _JOURNAL_COUNTS.get(path, 0) + len(records)
+        return _JOURNAL_COUNTS[path]
+
+
+def _sync_journals():
+    """fsync открытых журналов (для ?durable=1, когда JOURNAL_FSYNC выключен); False — ошибка записи"""
+    try:
+        for path, handle in list(_JOURNAL_HANDLES.items()):
+            with _file_lock(path):
+                if _JOURNAL_HANDLES.get(path) is handle:
+                    os.fsync(handle.fileno())
+        return True
+    except OSError as e:
+        print(f"❌ Ошибка fsync журнала: {e}")
+        return False
+
+
+def _replay_journal(path, items):
+    """Накатывает журнал <path>.log поверх списка из снапшота (put/del по id)"""
+    log_path = _journal_path(path)
+    if not os.path.exists(log_path):
+        return items
+    current = {item.get("id"): item for item in items}
+    added = []
+    count = 0
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # недописанная последняя строка после падения
+                print(f"⚠️ Повреждённая запись в {log_path}, остаток журнала пропущен")
+                break
+            if record.get("op") == "put":
+                item = record["item"]
+                if item.get("id") not in current:
+                    added.append(item.get("id"))
+                current[item.get("id")] = item
+            elif record.get("op") == "del":
+                current.pop(record.get("id"), None)
+            count += 1
+    # новые записи — в начало списка, как при создании через API
+    result = []
+    seen = set()
+    for item_id in list(reversed(added)) + [item.get("id") for item in items]:
+        if item_id in current and item_id not in seen:
+            seen.add(item_id)
+            result.append(current[item_id])
+    _JOURNAL_COUNTS[path] = count
+    print(f"📜 {log_path}: применено {count} записей журнала")
+    return result
+
+
+def _replay_settings_journal(path, settings):
+    log_path = _journal_path(path)
+    if not os.path.exists(log_path):
+        return settings
+    count = 0
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record.get("op") == "set":
+                settings = record.get("data") or {}
+            count += 1
+    _JOURNAL_COUNTS[path] = count
+    return settings
+
+
+class JsonFileStorage:
+    """Хранилище по умолчанию: JSON-файл на коллекцию, опционально с журналом изменений"""
+
+    FILES = {
+        "repairs": DATA_FILE,
+        "customers": CUSTOMERS_FILE,
+        "inventory": INVENTORY_FILE,
+        "appointments": APPOINTMENTS_FILE,
+        "settings": SETTINGS_FILE,
+    }
+
+    def __init__(self, journal=False):
+        self.journal = journal
+
+    def describe(self):
+        return f"JSON-файлы ({DATA_FILE}, ...)" + (", журнал" if self.journal else "")
+
+    def load(self, collection):
+        """Содержимое коллекции или None, если она ещё ни разу не сохранялась"""
+        path = self.FILES[collection]
+        # отложенный в .corrupt снапшот тоже считается: _load_json_file не даст начать с пустой коллекции
+        if not any(os.path.exists(p) for p in (path, _backup_path(path), path + '.corrupt', _journal_path(path))):
+            return None
+        data = _load_json_file(path, {})
+        if collection == "settings":
+            return _replay_settings_journal(path, data if isinstance(data, dict) else {})
+        key = "repairs" if collection == "repairs" else "items"
+        return _replay_journal(path, data.get(key, []) if isinstance(data, dict) else (data or []))
+
+    def save_all(self, collection, data):
+        path = self.FILES[collection]
+        if collection == "settings":
+            return _save_json_file(path, data)
+        key = "repairs" if collection == "repairs" else "items"
+        return _save_json_file(path, {key: data, "last_updated": datetime.now().isoformat(), "total": len(data)})
+
+    def sync(self):
+        """Дожидается записи на диск уже зафиксированных изменений; True — всё на диске"""
+        return _sync_journals() if self.journal and not JOURNAL_FSYNC else True
+
+    def append(self, collection, op, items):
+        """Инкрементальная запись изменений items; False — нужна полная запись коллекции"""
+        if not self.journal:
+            return False
+        if op == "del":
+            records = [{"op": "del", "id": item.get("id")} for item in items]
+        elif op == "set":
+            records = [{"op": "set", "data": item} for item in items]
+        else:
+            records = [{"op": "put", "item": item} for item in items]
+        # при переполнении журнала полная запись коллекции и есть чекпоинт
+        return _append_journal(self.FILES[collection], records) < JOURNAL_CHECKPOINT_EVERY
+
+    def pending(self, collection):
+        return _JOURNAL_COUNTS.get(self.FILES[collection], 0)
+
+    def needs_snapshot(self, collection):
+        return True
+
+    def load_change_seq(self):
+        """Сохранённая граница последовательности изменений (0 — ещё не сохранялась)"""
+        data = _load_json_file(CHANGE_SEQ_FILE, {})
+        return int(data.get("reserved", 0)) if isinstance(data, dict) else 0
+
+    def save_change_seq(self, value):
+        return _save_json_file(CHANGE_SEQ_FILE, {"reserved": value})
+
+
+class SqliteStorage:
+    """SQLite: таблица на коллекцию, запись хранится целиком в data, ключевые поля — в индексируемых колонках.
+
+    База заменяет файлы как хранилище и источник для query/iterate; коллекции при этом
+    всё равно загружаются в память целиком (RecordList, индексы, поиск, снимки).
+    """
+
+    # Коллекция -> индексируемые колонки (колонка = поле записи)
+    TABLES = {
+        "repairs": ("status", "urgency", "timestamp", "phone", "email", "deviceType", "problemType", "technician"),
+        "customers": ("phone", "email"),
+        "inventory": ("sku",),
+        "appointments": ("start", "status", "technician"),
+    }
+    OPERATORS = ("=", "<", "<=", ">", ">=", "in")
+    # Сортировки, которые не совпадают с порядком строк в колонке
+    ORDER_EXPRESSIONS = {
+        "urgency": "CASE urgency WHEN 'low' THEN 0 WHEN 'medium' THEN 1 WHEN 'high' THEN 2 ELSE -1 END",
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self.lock, self.conn:
+            for table, columns in self.TABLES.items():
+                cols = "".join(f", {c} TEXT" for c in columns)
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, seq INTEGER NOT NULL{cols}, data TEXT NOT NULL)")
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_seq ON {table}(seq)")
+                for c in columns:
+                    self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{c} ON {table}({c})")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # какие коллекции уже сохранялись (иначе при первом запуске нужны демо-данные)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY, saved_at TEXT)")
+            # служебные значения: граница последовательности изменений
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def describe(self):
+        return f"SQLite ({self.path})"
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def sync(self):
+        """WAL с synchronous=NORMAL не синхронизирует каждую транзакцию — переносим WAL в базу с fsync"""
+        try:
+            with self.lock:
+                self.conn.execute("PRAGMA wal_checkpoint(FULL)")
+            return True
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка синхронизации SQLite: {e}")
+            return False
+
+    @staticmethod
+    def _column_value(column, item):
+        value = item.get(column)
+        if value is None:
+            return None
+        if column == "phone":
+            return _normalize_phone(str(value))
+        if column == "email":
+            return str(value).strip().lower()
+        return str(value)
+
+    def _row(self, table, item, seq):
+        columns = self.TABLES[table]
+        return ((item.get("id"), seq) + tuple(self._column_value(c, item) for c in columns)
+                + (json.dumps(item, ensure_ascii=False, separators=(',', ':')),))
+
+    def _mark_saved(self, collection):
+        self.conn.execute("INSERT OR REPLACE INTO collections (name, saved_at) VALUES (?, ?)",
+                          (collection, datetime.now().isoformat()))
+
+    def load(self, collection):
+        with self.lock:
+            if not self.conn.execute("SELECT 1 FROM collections WHERE name = ?", (collection,)).fetchone():
+                return None
+            if collection == "settings":
+                return {k: json.loads(v) for k, v in self.conn.execute("SELECT key, value FROM settings")}
+            return [json.loads(d) for (d,) in self.conn.execute(f"SELECT data FROM {collection} ORDER BY seq DESC")]
+
+    def save_all(self, collection, data):
+        try:
+            with self.lock, self.conn:
+                if collection == "settings":
+                    self._write_settings(data)
+                else:
+                    columns = ("id", "seq") + self.TABLES[collection] + ("data",)
+                    placeholders = ", ".join("?" for _ in columns)
+                    self.conn.execute(f"DELETE FROM {collection}")
+                    total = len(data)
+                    self.conn.executemany(
+                        f"INSERT OR REPLACE INTO {collection} ({', '.join(columns)}) VALUES ({placeholders})",
+                        (self._row(collection, item, total - i) for i, item in enumerate(data)))
+                self._mark_saved(collection)
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка записи SQLite {collection}: {e}")
+            return False
+
+    def load_change_seq(self):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'change_seq'").fetchone()
+        return int(row[0]) if row else 0
+
+    def save_change_seq(self, value):
+        try:
+            with self.lock, self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('change_seq', ?)", (str(value),))
+            return True
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка записи SQLite meta: {e}")
+            return False
+
+    def _write_settings(self, data):
+        self.conn.execute("DELETE FROM settings")
+        self.conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)",
+                              ((k, json.dumps(v, ensure_ascii=False)) for k, v in data.items()))
+
+    def append(self, collection, op, items):
+        """Точечная запись строк items одной транзакцией вместо перезаписи коллекции"""
+        try:
+            with self.lock, self.conn:
+                if op == "set":
+                    self._write_settings(items[-1])
+                elif op == "del":
+                    self.conn.executemany(f"DELETE FROM {collection} WHERE id = ?",
+                                          ((item.get("id"),) for item in items))
+                else:
+                    columns = self.TABLES[collection]
+                    updates = ", ".join(f"{c} = excluded.{c}" for c in columns + ("data",))
+                    placeholders = ", ".join("?" for _ in columns)
+                    rows = (self._row(collection, item, None) for item in items)
+                    self.conn.executemany(
+                        f"INSERT INTO {collection} (id, seq, {', '.join(columns)}, data) "
+                        f"VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM {collection}), {placeholders}, ?) "
+                        f"ON CONFLICT(id) DO UPDATE SET {updates}",
+                        ((row[0],) + row[2:] for row in rows))
+                self._mark_saved(collection)
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка записи SQLite {collection}: {e}")
+            return False
+
+    def _where(self, collection, filters, order_by):
+        """WHERE и его аргументы по filters — [(колонка, оператор, значение)]; проверяет колонки"""
+        allowed = ("id", "seq") + self.TABLES[collection]
+        where, args = [], []
+        for column, op, value in filters:
+            if column not in allowed or op not in self.OPERATORS:
+                raise ValueError(f"Недопустимый фильтр: {column} {op}")
+            if op == "in":
+                values = list(value)
+                where.append(f"{column} IN ({', '.join('?' for _ in values)})" if values else "0")
+                args.extend(values)
+            else:
+                where.append(f"{column} {op} ?")
+                args.append(value)
+        if order_by not in allowed:
+            raise ValueError(f"Недопустимая сортировка: {order_by}")
+        return (f" WHERE {' AND '.join(where)}" if where else ""), args
+
+    def query(self, collection, filters=(), order_by="seq", descending=True, limit=None, offset=0):
+        """Выборка на стороне SQLite: filters — [(колонка, оператор, значение)], возвращает (записи, всего)"""
+        clause, args = self._where(collection, filters, order_by)
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM {collection}{clause}", args).fetchone()[0]
+            order = self.ORDER_EXPRESSIONS.get(order_by, order_by)
+            sql = f"SELECT data FROM {collection}{clause} ORDER BY {order} {'DESC' if descending else 'ASC'}, seq DESC"
+            if limit is not None:
+                sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+            items = [json.loads(d) for (d,) in self.conn.execute(sql, args)]
+        return items, total
+
+    def iterate(self, collection, filters=(), order_by="seq", descending=True):
+        """Записи по одной из отдельного соединения в читающей транзакции.
+
+        WAL даёт транзакции неизменный срез базы, поэтому долгая выгрузка целостна
+        и не держит self.lock — запись в это время продолжается.
+        """
+        clause, args = self._where(collection, filters, order_by)
+        order = self.ORDER_EXPRESSIONS.get(order_by, order_by)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            conn.execute("BEGIN")
+            cursor = conn.execute(f"SELECT data FROM {collection}{clause} "
+                                  f"ORDER BY {order} {'DESC' if descending else 'ASC'}, seq DESC", args)
+            for (data,) in cursor:
+                yield json.loads(data)
+        finally:
+            conn.close()
+
+    def pending(self, collection):
+        return 0
+
+    def needs_snapshot(self, collection):
+        # каждое изменение уже записано в базу
+        return False
+
+
+def create_storage(backend):
+    if backend == 'sqlite':
+        return SqliteStorage(SQLITE_FILE)
+    if backend != 'json':
+        print(f"⚠️ Неизвестный STORAGE_BACKEND={backend!r}, используются JSON-файлы")
+    return JsonFileStorage(journal=STORAGE_JOURNAL)
+
+
+STORAGE = create_storage(STORAGE_BACKEND)
+CHANGE_SEQ = CHANGE_SEQ_LIMIT = CHANGE_BASE = STORAGE.load_change_seq()
+
+
+def _reserve_change_seq():
+    """Сохраняет границу следующего блока номеров до их выдачи (вызывать под CHANGE_LOCK)"""
+    global CHANGE_SEQ_LIMIT
+    CHANGE_SEQ_LIMIT = CHANGE_SEQ + CHANGE_SEQ_BLOCK
+    if not STORAGE.save_change_seq(CHANGE_SEQ_LIMIT):
+        print("⚠️ Граница последовательности изменений не сохранена: после перезапуска номера могут повториться")
+
+
+def _log_change(collection, record_id, op):
+    """Присваивает изменению следующий номер последовательности (вызывать под CHANGE_LOCK)"""
+    global CHANGE_SEQ
+    if CHANGE_SEQ >= CHANGE_SEQ_LIMIT:
+        _reserve_change_seq()
+    CHANGE_SEQ += 1
+    key = (collection, record_id)
+    CHANGE_LOG.pop(key, None)
+    CHANGE_LOG[key] = (CHANGE_SEQ, op)
+    return CHANGE_SEQ
+
+
+def _log_loaded(collection, items):
+    """Загруженные записи попадают в журнал изменений: since=0 отдаёт весь набор данных"""
+    with CHANGE_LOCK:
+        for item in reversed(items):
+            _log_change(collection, item.get("id"), "put")
+
+
+def load_repairs():
+    """Загрузка заявок из файла"""
+    global REPAIRS_STORAGE, REPAIRS_INDEX
+    try:
+        data = STORAGE.load("repairs")
+    except Exception as e:
+        # пустой список вместо данных был бы сохранён поверх файла — коллекция остаётся незагруженной
+        print(f"❌ Ошибка загрузки данных: {e}")
+        raise
+    if data is not None:
+        REPAIRS_STORAGE = RecordList(data)
+        print(f"📂 Загружено {len(REPAIRS_STORAGE)} заявок: {STORAGE.describe()}")
+    else:
+        # Создаем демо-данные при первом запуске
+        REPAIRS_STORAGE = RecordList([
+            {
+                "id": "repair_001",
+                "firstName": "Алексей",
+                "lastName": "Петров",
+                "phone": "+7 (999) 123-45-67",
+                "email": "alex@example.com",
+                "deviceType": "smartphone",
+                "deviceBrand": "iPhone 14 Pro",
+                "problemType": "screen",
+                "urgency": "high",
+                "address": "ул. Ленина, 15, кв. 42",
+                "description": "Разбился экран после падения. Тачскрин не работает.",
+                "status": "new",
+                "timestamp": "2026-01-22T10:30:00Z",
+                "source": "demo"
+            },
+            {
+                "id": "repair_002",
+                "firstName": "Мария",
+                "lastName": "Сидорова",
+                "phone": "+7 (999) 987-65-43",
+                "email": "maria@example.com",
+                "deviceType": "laptop",
+                "deviceBrand": "HP Pavilion 15",
+                "problemType": "performance",
+                "urgency": "medium",
+                "address": "пр. Мира, 88",
+                "description": "Ноутбук очень медленно работает, долго загружается.",
+                "status": "in-progress",
+                "timestamp": "2026-01-21T14:15:00Z",
+                "source": "demo"
+            }
+        ])
+        save_repairs()
+        print(f"📝 Созданы демо-данные: {len(REPAIRS_STORAGE)} заявок")
+    REPAIRS_INDEX = REPAIRS_STORAGE.index
+    _reindex_repairs()
+    # сводки по заявкам в срезе клиентов, снятом до загрузки заявок, устарели все
+    CUSTOMERS_STORAGE.touch_all()
+    _log_loaded("repairs", REPAIRS_STORAGE)
+
+
+def load_customers():
+    global CUSTOMERS_STORAGE, CUSTOMERS_INDEX, CUSTOMER_KEYS
+    CUSTOMERS_STORAGE = RecordList(STORAGE.load("customers") or [])
+    CUSTOMERS_INDEX = CUSTOMERS_STORAGE.index
+    CUSTOMER_KEYS = {}
+    for customer in CUSTOMERS_STORAGE:
+        key = _customer_key(customer.get("phone"), customer.get("email"))
+        if key:
+            CUSTOMER_KEYS.setdefault(key, []).append(customer)
+    _log_loaded("customers", CUSTOMERS_STORAGE)
+
+
+def save_customers():
+    return STORAGE.save_all("customers", list(CUSTOMERS_STORAGE))
+
+
+def load_inventory():
+    global INVENTORY_STORAGE, INVENTORY_INDEX
+    INVENTORY_STORAGE = RecordList(STORAGE.load("inventory") or [])
+    INVENTORY_INDEX = INVENTORY_STORAGE.index
+    _log_loaded("inventory", INVENTORY_STORAGE)
+
+
+def save_inventory():
+    return STORAGE.save_all("inventory", list(INVENTORY_STORAGE))
+
+
+def load_appointments():
+    global APPOINTMENTS_STORAGE, APPOINTMENTS_INDEX
+    APPOINTMENTS_STORAGE = RecordList(STORAGE.load("appointments") or [])
+    APPOINTMENTS_INDEX = APPOINTMENTS_STORAGE.index
+    _log_loaded("appointments", APPOINTMENTS_STORAGE)
+
+
+def save_appointments():
+    return STORAGE.save_all("appointments", list(APPOINTMENTS_STORAGE))
+
+
+def load_settings():
+    global SETTINGS_STORAGE
+    SETTINGS_STORAGE = STORAGE.load("settings") or {}
+    _log_loaded("settings", [{"id": None}])
+
+
+def save_settings():
+    return STORAGE.save_all("settings", SETTINGS_STORAGE)
+
+
+_NON_DIGIT_RE = re.compile(r"\D")
+
+
+def _normalize_phone(phone):
+    """Только цифры; российский 8XXXXXXXXXX приводится к 7XXXXXXXXXX (номер числом тоже подходит)"""
+    digits = _NON_DIGIT_RE.sub("", str(phone if phone is not None else ""))
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    return digits
+
+
+def _customer_key(phone, email):
+    phone = _normalize_phone(phone)
+    email = str(email if email is not None else "").strip().lower()
+    return phone or email or None
+
+
+def _index_customer(customer):
+    """Добавляет клиента в CUSTOMER_KEYS, возвращает его ключ"""
+    key = _customer_key(customer.get("phone"), customer.get("email"))
+    if key:
+        CUSTOMER_KEYS.setdefault(key, []).insert(0, customer)
+    return key
+
+
+def _unindex_customer(customer, key):
+    bucket = CUSTOMER_KEYS.get(key)
+    if not bucket:
+        return
+    bucket[:] = [c for c in bucket if c is not customer]
+    if not bucket:
+        del CUSTOMER_KEYS[key]
+
+
+def find_customer_by_key(key):
+    bucket = CUSTOMER_KEYS.get(key)
+    return bucket[0] if bucket else None
+
+
+def _repair_day(repair):
+    """Дата создания заявки (YYYY-MM-DD) или None, если timestamp не разбирается"""
+    try:
+        return datetime.fromisoformat(repair['timestamp'].replace('Z', '+00:00')).date().isoformat()
+    except Exception:
+        return None
+
+
+def _repair_stat_keys(repair):
+    return (("status", repair.get("status")), ("urgency", repair.get("urgency")), ("day", _repair_day(repair)))
+
+
+def _index_repair(repair):
+    """Добавляет заявку во вторичные индексы (клиент -> заявки, счётчики статистики, поиск)"""
+    SEARCH_INDEX.index("repair", repair)
+    _count_repair(repair)
+    _touch_customers(_customer_key(repair.get("phone"), repair.get("email")))
+
+
+def _touch_customers(key):
+    """Сводка по заявкам у клиентов с этим ключом изменилась — их копии в срезе устарели"""
+    for customer in CUSTOMER_KEYS.get(key) or ():
+        CUSTOMERS_STORAGE.touch(customer.get("id"))
+
+
+def _count_repair(repair):
+    """Счётчики статистики и индекс клиент -> заявки (без поиска)"""
+    for group, value in _repair_stat_keys(repair):
+        REPAIR_STATS[group][value] += 1
+    key = _customer_key(repair.get("phone"), repair.get("email"))
+    if key:
+        entry = CUSTOMER_REPAIRS.setdefault(key, {"repairs": {}, "last": ""})
+        timestamp = repair.get("timestamp") or ""
+        entry["repairs"][repair.get("id")] = timestamp
+        if timestamp > entry["last"]:
+            entry["last"] = timestamp
+
+
+def _unindex_repair(repair):
+    """Убирает заявку из вторичных индексов; repair — её состояние до изменения"""
+    SEARCH_INDEX.remove("repair", repair.get("id"))
+    for group, value in _repair_stat_keys(repair):
+        counter = REPAIR_STATS[group]
+        counter[value] -= 1
+        if counter[value] <= 0:
+            del counter[value]
+    key = _customer_key(repair.get("phone"), repair.get("email"))
+    entry = CUSTOMER_REPAIRS.get(key)
+    if entry:
+        timestamp = entry["repairs"].pop(repair.get("id"), None)
+        if not entry["repairs"]:
+            del CUSTOMER_REPAIRS[key]
+        elif timestamp is not None and timestamp == entry["last"]:
+            entry["last"] = max(entry["repairs"].values())
+    _touch_customers(key)
+
+
+def _reindex_repairs():
+    """Счётчики и индекс клиентов после загрузки; поисковый индекс строится отдельно (build_search_index)"""
+    CUSTOMER_REPAIRS.clear()
+    for counter in REPAIR_STATS.values():
+        counter.clear()
+    for repair in REPAIRS_STORAGE:
+        _count_repair(repair)
+
+
+_SEARCH_WORD_RE = re.compile(r"\w+")
+
+
+class SearchIndex:
+    """Инвертированный индекс для /api/search: токен -> {документ: вес поля}.
+
+    Документ — ("repair" | "customer", id). В индексе лежат только целые слова, а поиск идёт
+    по префиксу через отсортированный словарь токенов, поэтому находятся и фрагменты
+    имён и моделей. Для телефона индексируются суффиксы цифр — так находится любой кусок номера.
+    Новые токены копятся в небольшом отсортированном списке и вливаются в основной словарь
+    пачкой, чтобы массовая загрузка не сдвигала большой список на каждой вставке.
+    После загрузки индекс строится целиком (begin_bulk/bulk_index): словарь сортируется один раз.
+    """
+
+    # Поля документа и их вес в ранжировании
+    FIELDS = {
+        "repair": (("firstName", 3), ("lastName", 3), ("email", 2), ("deviceBrand", 2),
+                   ("deviceType", 1), ("problemType", 1), ("technician", 1), ("address", 1), ("description", 1)),
+        "customer": (("firstName", 3), ("lastName", 3), ("email", 2), ("note", 1)),
+    }
+    PHONE_WEIGHT = 3
+    PREFIX_FACTOR = 0.6
+    PENDING_LIMIT = 2048
+    BULK_CHUNK = 5000
+    # Слово запроса короче не ищется (цифры — кусок телефона — короче MIN_DIGITS_TERM):
+    # одна-две буквы или цифры раскрываются в большую часть словаря
+    MIN_TERM = 2
+    MIN_DIGITS_TERM = 3
+    # Сколько слов словаря берётся по префиксу одного слова запроса и сколько документов ранжируется
+    PREFIX_LIMIT = 100
+    CANDIDATES_LIMIT = 5000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.vocabulary = []
+        self.pending = []
+        self.documents = {}
+        # kind -> документы, изменённые во время массового построения (их состояние новее среза)
+        self.touched = {}
+
+    @staticmethod
+    def tokenize(text):
+        return _SEARCH_WORD_RE.findall(str(text or "").lower().replace("ё", "е"))
+
+    def _document_tokens(self, kind, record):
+        tokens = {}
+        for field, weight in self.FIELDS[kind]:
+            for token in self.tokenize(record.get(field)):
+                if weight > tokens.get(token, 0):
+                    tokens[token] = weight
+        digits = _normalize_phone(record.get("phone"))
+        for i in range(max(0, len(digits) - 2)):
+            tokens[digits[i:]] = self.PHONE_WEIGHT
+        return tokens
+
+    def index(self, kind, record):
+        """Добавляет или переиндексирует запись"""
+        doc = (kind, record.get("id"))
+        tokens = self._document_tokens(kind, record)
+        with self.lock:
+            self._touch(doc)
+            self._remove(doc)
+            for token, weight in tokens.items():
+                posting = self.postings.get(token)
+                if posting is None:
+                    posting = self.postings[token] = {}
+                    bisect.insort(self.pending, token)
+                posting[doc] = weight
+            self.documents[doc] = tuple(tokens)
+            if len(self.pending) > max(self.PENDING_LIMIT, len(self.vocabulary) // 8):
+                self._merge_pending()
+
+    def remove(self, kind, record_id):
+        with self.lock:
+            self._touch((kind, record_id))
+            self._remove((kind, record_id))
+
+    def _touch(self, doc):
+        touched = self.touched.get(doc[0])
+        if touched is not None:
+            touched.add(doc)
+
+    def begin_bulk(self, kind):
+        """Начало массового построения: документы kind убираются, дальнейшие изменения отмечаются.
+
+        Вызывать под блокировкой коллекции вместе со снятием среза её записей.
+        """
+        with self.lock:
+            for doc in [d for d in self.documents if d[0] == kind]:
+                self._remove(doc)
+            self.touched[kind] = set()
+
+    def bulk_index(self, kind, records):
+        """Индексирует срез записей пачками; токены добавляются без сортировки, словарь сортируется в конце.
+
+        Документы, изменённые после begin_bulk, пропускаются — их уже проиндексировали index()/remove().
+        """
+        for start in range(0, len(records), self.BULK_CHUNK):
+            chunk = [((kind, record.get("id")), self._document_tokens(kind, record))
+                     for record in records[start:start + self.BULK_CHUNK]]
+            with self.lock:
+                touched = self.touched[kind]
+                postings = self.postings
+                for doc, tokens in chunk:
+                    if doc in touched:
+                        continue
+                    for token, weight in tokens.items():
+                        posting = postings.get(token)
+                        if posting is None:
+                            posting = postings[token] = {}
+                        posting[doc] = weight
+                    self.documents[doc] = tuple(tokens)
+        with self.lock:
+            del self.touched[kind]
+            self.vocabulary = sorted(self.postings)
+            self.pending = []
+
+    def _remove(self, doc):
+        # Опустевшие токены остаются в словаре до следующего слияния — поиск их пропускает
+        for token in self.documents.pop(doc, ()):
+            posting = self.postings[token]
+            posting.pop(doc, None)
+            if not posting:
+                del self.postings[token]
+
+    def _merge_pending(self):
+        postings = self.postings
+        self.vocabulary = [t for t in sorted(self.vocabulary + self.pending) if t in postings]
+        self.pending = []
+
+    def _prefix_postings(self, term):
+        """Постинг самого слова и не больше PREFIX_LIMIT слов с этим префиксом: [(множитель веса, постинг)]"""
+        exact = self.postings.get(term)
+        postings = [(1.0, exact)] if exact else []
+        for vocabulary in (self.vocabulary, self.pending):
+            for i in range(bisect.bisect_right(vocabulary, term), len(vocabulary)):
+                token = vocabulary[i]
+                if not token.startswith(term) or len(postings) >= self.PREFIX_LIMIT:
+                    break
+                posting = self.postings.get(token)
+                if posting:
+                    postings.append((self.PREFIX_FACTOR, posting))
+        return postings
+
+    def query_terms(self, query):
+        """Слова запроса, по которым идёт поиск; слишком короткие отбрасываются"""
+        return {term for term in self.tokenize(query)
+                if len(term) >= (self.MIN_DIGITS_TERM if term.isdigit() else self.MIN_TERM)}
+
+    def search(self, query, kinds=None, limit=20):
+        """Документы, содержащие все слова запроса (как слово или префикс): [((kind, id), score)].
+
+        ValueError — в запросе нет ни одного слова достаточной длины. Под блокировкой индекса
+        только набираются кандидаты по самому редкому слову (не больше CANDIDATES_LIMIT);
+        остальные слова проверяются и документы ранжируются уже без неё — поиск не держит
+        запись заявок, которая переиндексирует их под той же блокировкой.
+        """
+        terms = self.query_terms(query)
+        if not terms:
+            raise ValueError(f"в запросе нет слова от {self.MIN_TERM} букв или от {self.MIN_DIGITS_TERM} цифр")
+        with self.lock:
+            matches = [self._prefix_postings(term) for term in terms]
+            # Пересечение начинаем с самого редкого слова, остальные проверяем только по кандидатам
+            matches.sort(key=lambda postings: sum(len(p) for _, p in postings))
+            scores = {}
+            for factor, posting in matches[0]:
+                for doc, weight in posting.items():
+                    if (not kinds or doc[0] in kinds) and weight * factor > scores.get(doc, 0):
+                        scores[doc] = weight * factor
+                        if len(scores) >= self.CANDIDATES_LIMIT:
+                            break
+                if len(scores) >= self.CANDIDATES_LIMIT:
+                    break
+        # Дальше постинги только читаются по ключу — параллельная переиндексация этому не мешает
+        for postings in matches[1:]:
+            if not scores:
+                break
+            narrowed = {}
+            for doc, score in scores.items():
+                best = max((posting.get(doc, 0) * factor for factor, posting in postings), default=0)
+                if best:
+                    narrowed[doc] = score + best
+            scores = narrowed
+        return heapq.nlargest(limit, scores.items(), key=lambda pair: pair[1])
+
+
+SEARCH_INDEX = SearchIndex()
+# Поисковый индекс построен: до этого /api/search ждёт build_search_index()
+SEARCH_READY = threading.Event()
+SEARCH_BUILD_LOCK = threading.Lock()
+
+
+# Фильтры и сортировки списка заявок
+REPAIR_FILTER_FIELDS = ("status", "urgency", "deviceType", "problemType", "technician")
+REPAIR_SORT_FIELDS = ("timestamp", "status", "urgency", "deviceType", "problemType", "technician")
+URGENCY_RANK = {"low": 0, "medium": 1, "high": 2}
+REPAIR_STATUSES = ("new", "in-progress", "completed", "cancelled")
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+def parse_repairs_query(params):
+    """Разбирает параметры списка заявок: фильтры, сортировку и пагинацию.
+
+    Фильтры: status, urgency, deviceType, problemType, technician (через запятую — любое из значений),
+    date_from/date_to (YYYY-MM-DD или полный ISO, границы включительно).
+    Сортировка: sort=<поле> или sort=-<поле> (по убыванию). Пагинация: page/per_page или limit/offset;
+    без них возвращается весь отфильтрованный список.
+    """
+    filters = []
+    for field in REPAIR_FILTER_FIELDS:
+        values = [v.strip() for v in params.get(field, "").split(',') if v.strip()]
+        if values:
+            filters.append((field, "in", values))
+    if params.get("date_from"):
+        filters.append(("timestamp", ">=", params["date_from"]))
+    if params.get("date_to"):
+        # любая метка времени с префиксом date_to меньше date_to + U+FFFF
+        filters.append(("timestamp", "<=", params["date_to"] + "\uffff"))
+
+    sort = params.get("sort", "")
+    descending = sort.startswith("-") or params.get("order", "").lower() == "desc"
+    sort = sort.lstrip("-")
+    if sort and sort not in REPAIR_SORT_FIELDS:
+        raise ValueError(f"Недопустимая сортировка: {sort}")
+
+    limit, offset = None, 0
+    if "limit" in params or "offset" in params:
+        limit = int(params.get("limit", DEFAULT_PER_PAGE))
+        offset = int(params.get("offset", 0))
+    elif "page" in params or "per_page" in params:
+        limit = int(params.get("per_page", DEFAULT_PER_PAGE))
+        offset = (max(1, int(params.get("page", 1))) - 1) * limit
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PER_PAGE))
+        offset = max(0, offset)
+    return {"filters": filters, "sort": sort or None, "descending": descending, "limit": limit, "offset": offset}
+
+
+def _repair_matches(repair, filters):
+    for field, op, value in filters:
+        current = repair.get(field) or ""
+        if op == "in":
+            if current not in value:
+                return False
+        elif op == ">=":
+            if current < value:
+                return False
+        elif op == "<=":
+            if current > value:
+                return False
+    return True
+
+
+def _repair_sort_key(field):
+    if field == "urgency":
+        return lambda r: URGENCY_RANK.get(r.get("urgency"), -1)
+    return lambda r: str(r.get(field) or "")
+
+
+def query_repairs(query, repairs=None):
+    """Заявки по разобранному запросу: (страница, число подходящих под фильтры).
+
+    С SQLite выборка выполняется в базе по индексам, иначе — в памяти по repairs
+    (срез snapshot("repairs"), если не передан).
+    """
+    if isinstance(STORAGE, SqliteStorage):
+        return STORAGE.query("repairs", query["filters"],
+                             order_by=query["sort"] or "seq",
+                             descending=query["descending"] if query["sort"] else True,
+                             limit=query["limit"], offset=query["offset"])
+    if repairs is None:
+        repairs = snapshot("repairs").items
+    filters = query["filters"]
+    items = [r for r in repairs if _repair_matches(r, filters)] if filters else list(repairs)
+    if query["sort"]:
+        items.sort(key=_repair_sort_key(query["sort"]), reverse=query["descending"])
+    total = len(items)
+    if query["limit"] is not None:
+        items = items[query["offset"]:query["offset"] + query["limit"]]
+    return items, total
+
+
+# Колонки CSV-выгрузки заявок (NDJSON отдаёт записи целиком)
+REPAIR_EXPORT_FIELDS = ("id", "timestamp", "status", "urgency", "firstName", "lastName", "phone", "email",
+                        "deviceType", "deviceBrand", "problemType", "technician", "address", "description",
+                        "completion_date", "updated_at", "source")
+
+
+def iter_repairs(query):
+    """Заявки по запросу без пагинации — по одной, из целостного среза.
+
+    В памяти это snapshot("repairs"), в SQLite — читающая транзакция; страница
+    ответа целиком в памяти не собирается.
+    """
+    if isinstance(STORAGE, SqliteStorage):
+        yield from STORAGE.iterate("repairs", query["filters"], order_by=query["sort"] or "seq",
+                                   descending=query["descending"] if query["sort"] else True)
+        return
+    filters = query["filters"]
+    items = snapshot("repairs").items
+    if query["sort"]:
+        items = sorted(items, key=_repair_sort_key(query["sort"]), reverse=query["descending"])
+    for repair in items:
+        if not filters or _repair_matches(repair, filters):
+            yield repair
+
+
+def _ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def _csv_lines(records):
+    # BOM — чтобы Excel открыл кириллицу в UTF-8
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPAIR_EXPORT_FIELDS)
+    yield '\ufeff' + buffer.getvalue()
+    for record in records:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([record.get(field, "") for field in REPAIR_EXPORT_FIELDS])
+        yield buffer.getvalue()
+
+
+# Формат выгрузки -> (Content-Type, строки из записей)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson; charset=utf-8", _ndjson_lines),
+    "csv": ("text/csv; charset=utf-8", _csv_lines),
+}
+
+
+def export_chunks(records, fmt, encoding=None):
+    """Куски выгрузки по EXPORT_CHUNK_SIZE, при encoding — сжатые потоково"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, COMPRESS_WBITS[encoding]) if encoding else None
+    pending, size = [], 0
+    for line in EXPORT_FORMATS[fmt][1](records):
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_SIZE:
+            chunk = b"".join(pending)
+            pending, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def verify_repair_stats():
+    """Пересчитывает счётчики статистики с нуля; при расхождении исправляет их и возвращает отличия"""
+    with LOCKS["repairs"]:
+        actual = {group: Counter() for group in REPAIR_STATS}
+        for repair in REPAIRS_STORAGE:
+            for group, value in _repair_stat_keys(repair):
+                actual[group][value] += 1
+        drift = {}
+        for group, counter in REPAIR_STATS.items():
+            for value in set(counter) | set(actual[group]):
+                if counter[value] != actual[group][value]:
+                    drift.setdefault(group, {})[str(value)] = {"counter": counter[value], "actual": actual[group][value]}
+            counter.clear()
+            counter.update(actual[group])
+    if drift:
+        print(f"⚠️ Расхождение счётчиков статистики: {drift}")
+    return drift
+
+
+def customer_repairs_summary(customer):
+    """Количество, дата последней и id заявок клиента (новые первыми) без обхода REPAIRS_STORAGE"""
+    entry = CUSTOMER_REPAIRS.get(_customer_key(customer.get("phone"), customer.get("email")))
+    if not entry:
+        return {"repairs_count": 0, "last_repair_at": None, "repair_ids": []}
+    repairs = entry["repairs"]
+    return {
+        "repairs_count": len(repairs),
+        "last_repair_at": entry["last"] or None,
+        "repair_ids": sorted(repairs, key=repairs.get, reverse=True),
+    }
+
+
+CUSTOMER_CONTACT_FIELDS = ("firstName", "lastName", "phone", "email")
+
+
+def _upsert_customer(data, fields=CUSTOMER_CONTACT_FIELDS):
+    """Находит клиента по телефону/email из data и обновляет его или создаёт нового.
+
+    Вызывать под LOCKS["customers"]; изменение не фиксируется — это делает вызывающий.
+    Возвращает (клиент, "create" | "update").
+    """
+    key = _customer_key(data.get("phone"), data.get("email"))
+    existing = find_customer_by_key(key) if key else None
+    if existing:
+        # обновляем контактные данные/имя, но не затираем явно заполненное пустым
+        for field in fields:
+            v = data.get(field)
+            if v:
+                existing[field] = v
+        existing["updated_at"] = datetime.now().isoformat()
+        if _customer_key(existing.get("phone"), existing.get("email")) != key:
+            _unindex_customer(existing, key)
+            _index_customer(existing)
+        event = "update"
+    else:
+        existing = {
+            "id": str(uuid.uuid4()),
+            "firstName": data.get("firstName", ""),
+            "lastName": data.get("lastName", ""),
+            "phone": data.get("phone", ""),
+            "email": data.get("email", ""),
+            "note": data.get("note", "") if "note" in fields else "",
+            "created_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat(),
+        }
+        CUSTOMERS_STORAGE.insert(existing)
+        _index_customer(existing)
+        event = "create"
+    SEARCH_INDEX.index("customer", existing)
+    return existing, event
+
+
+def upsert_customer_from_repair(repair: dict):
+    """Создаёт/обновляет клиента по заявке (по телефону или email)"""
+    if not _customer_key(repair.get("phone"), repair.get("email")):
+        return
+    with LOCKS["customers"]:
+        customer, event = _upsert_customer(repair)
+        record_change("customers", "put", customer, event)
+
+
+def upsert_customers(records, fields=CUSTOMER_CONTACT_FIELDS):
+    """Пакетный _upsert_customer: одна блокировка и одна фиксация на все записи.
+
+    Возвращает [(клиент-копия, событие)] в порядке records. Клиент, встретившийся
+    несколько раз, фиксируется один раз с последним состоянием.
+    """
+    results = []
+    with LOCKS["customers"]:
+        changed = {}
+        for data in records:
+            customer, event = _upsert_customer(data, fields)
+            results.append((customer, event))
+            previous = changed.pop(customer["id"], None)
+            changed[customer["id"]] = (customer, previous[1] if previous else event)
+        if changed:
+            record_changes("customers", "put", [c for c, _ in changed.values()],
+                           [e for _, e in changed.values()])
+        return [(dict(c), e) for c, e in results]
+
+
+# Поля заявки, которые клиент задаёт текстом (PUT /api/repairs/<id> меняет только их)
+REPAIR_TEXT_FIELDS = ("firstName", "lastName", "phone", "email", "deviceType", "deviceBrand", "problemType",
+                      "urgency", "address", "description", "status", "technician")
+
+
+def _repair_text(field, value):
+    """Значение текстового поля заявки: число приводится к строке, список или объект — ValueError.
+
+    Проверять до изменения заявки: значения попадают в индексы и счётчики, где
+    несовместимый тип оставил бы заявку изменённой, но не зафиксированной.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"Поле {field} должно быть строкой")
+    return str(value)
+
+
+def _repair_status(value):
+    """Новый статус заявки из запроса; ValueError — не из REPAIR_STATUSES"""
+    status = _repair_text("status", value)
+    if status not in REPAIR_STATUSES:
+        raise ValueError(f"Недопустимый статус: {status}")
+    return status
+
+
+def build_repair(data, history=False):
+    """Новая заявка из данных формы или интеграции; ValueError — данные не подходят.
+
+    history=True — перенос существующих заявок: id, статус, мастер, даты и источник
+    берутся из данных, если заданы (иначе как у новой заявки с лендинга).
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Ожидается JSON-объект")
+    text = {field: _repair_text(field, data.get(field)) for field in REPAIR_TEXT_FIELDS if field in data}
+    repair = {
+        "id": str(uuid.uuid4()),
+        "firstName": text.get('firstName', ''),
+        "lastName": text.get('lastName', ''),
+        "phone": text.get('phone', ''),
+        "email": text.get('email', ''),
+        "deviceType": text.get('deviceType', ''),
+        "deviceBrand": text.get('deviceBrand', ''),
+        "problemType": text.get('problemType', ''),
+        "urgency": text.get('urgency', 'low'),
+        "address": text.get('address', ''),
+        "description": text.get('description', ''),
+        "status": "new",
+        "timestamp": datetime.now().isoformat(),
+        "source": "repair_landing"
+    }
+    if not history:
+        return repair
+    repair['urgency'] = text.get('urgency') or 'low'
+    if repair['urgency'] not in URGENCY_RANK:
+        raise ValueError(f"Недопустимая срочность: {repair['urgency']}")
+    if data.get('id'):
+        repair['id'] = str(data['id'])
+    status = _repair_status(text.get('status') or 'new')
+    repair['status'] = status
+    for field in ('timestamp', 'completion_date', 'updated_at'):
+        value = data.get(field)
+        if not value:
+            continue
+        try:
+            datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f"Недопустимая дата в {field}: {value}")
+        repair[field] = str(value)
+    if status == 'completed' and 'completion_date' not in repair:
+        repair['completion_date'] = repair.get('updated_at') or repair['timestamp']
+    if text.get('technician'):
+        repair['technician'] = text['technician']
+    repair['source'] = data.get('source') or 'batch'
+    return repair
+
+
+def create_repairs(records, history=True, skip_existing=False):
+    """Пакетное создание заявок: проверка, вставка под одной блокировкой, одна фиксация
+    заявок и одна — клиентов.
+
+    records — разобранные элементы пакета (или исключение разбора на месте элемента).
+    Возвращает результаты по элементам: {"index", "status": "created", "id"} или {"index", "status": "error", "error"};
+    skip_existing — заявка с уже известным id не ошибка, а {"status": "skipped"} (повторный импорт).
+    """
+    results = [None] * len(records)
+    created = []
+    seen = set()
+    with LOCKS["repairs"]:
+        for i, data in enumerate(records):
+            try:
+                if isinstance(data, Exception):
+                    raise data
+                repair = build_repair(data, history)
+                if (repair["id"] in REPAIRS_INDEX or repair["id"] in seen) and skip_existing:
+                    results[i] = {"index": i, "status": "skipped", "id": repair["id"]}
+                    continue
+                if repair["id"] in REPAIRS_INDEX or repair["id"] in seen:
+                    raise ValueError(f"Заявка {repair['id']} уже существует")
+            except ValueError as e:
+                results[i] = {"index": i, "status": "error", "error": str(e)}
+                continue
+            seen.add(repair["id"])
+            created.append(repair)
+            results[i] = {"index": i, "status": "created", "id": repair["id"]}
+        if created:
+            REPAIRS_STORAGE.extend(created)
+            for repair in created:
+                _index_repair(repair)
+            record_changes("repairs", "put", created, "create")
+    contacts = [r for r in created if _customer_key(r.get("phone"), r.get("email"))]
+    if contacts:
+        upsert_customers(contacts)
+    return results
+
+
+def _set_repair_status(repair, status, now):
+    """Меняет статус заявки; при завершении проставляет completion_date"""
+    repair['status'] = status
+    repair['updated_at'] = now
+    if status == 'completed':
+        repair['completion_date'] = now
+
+
+def update_repair_statuses(changes):
+    """Массовая смена статусов за один проход под одной блокировкой и с одной фиксацией.
+
+    changes — [{"id", "status", "technician"?}]. Возвращает результаты по элементам:
+    updated, unchanged (статус и мастер уже такие) или error с причиной.
+    """
+    results = []
+    updated = []
+    now = datetime.now().isoformat()
+    changed_ids = set()
+    with LOCKS["repairs"]:
+        for i, change in enumerate(changes):
+            repair_id = change.get("id") if isinstance(change, dict) else None
+            result = {"index": i, "id": repair_id}
+            results.append(result)
+            status = change.get("status") if isinstance(change, dict) else None
+            repair = REPAIRS_INDEX.get(repair_id) if isinstance(repair_id, str) else None
+            technician = change.get("technician") if isinstance(change, dict) else None
+            try:
+                technician = None if technician is None else _repair_text("technician", technician)
+            except ValueError as e:
+                result.update(status="error", error=str(e))
+                continue
+            if status not in REPAIR_STATUSES:
+                result.update(status="error", error=f"Недопустимый статус: {status}")
+            elif repair is None:
+                result.update(status="error", error="Заявка не найдена")
+            elif repair.get("status") == status and technician in (None, repair.get("technician")):
+                result["status"] = "unchanged"
+            else:
+                _unindex_repair(dict(repair))
+                result["from"] = repair.get("status")
+                _set_repair_status(repair, status, now)
+                if technician is not None:
+                    repair["technician"] = technician
+                _index_repair(repair)
+                if repair_id not in changed_ids:
+                    changed_ids.add(repair_id)
+                    updated.append(repair)
+                result["status"] = "updated"
+        if updated:
+            record_changes("repairs", "put", updated, "status")
+    return results
+
+
+def import_repairs(lines, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Потоковый импорт заявок из строк NDJSON (bytes; None — строка длиннее IMPORT_MAX_LINE).
+
+    Строки копятся до chunk_size и фиксируются через create_repairs() — с пакетным
+    обновлением клиентов, поэтому в памяти не больше одного куска. Заявки с уже
+    известным id пропускаются: прерванный импорт можно просто запустить заново.
+    progress(report) вызывается после каждого куска. Возвращает итоговый отчёт.
+    """
+    started = time.time()
+    report = {"processed": 0, "created": 0, "skipped": 0, "failed": 0, "errors": []}
+    chunk, numbers = [], []
+
+    def commit():
+        for number, result in zip(numbers, create_repairs(chunk, skip_existing=True)):
+            if result["status"] == "error":
+                report["failed"] += 1
+                if len(report["errors"]) < IMPORT_MAX_ERRORS:
+                    report["errors"].append({"line": number, "error": result["error"]})
+            else:
+                report[result["status"]] += 1
+        report["processed"] += len(chunk)
+        chunk.clear()
+        numbers.clear()
+        if progress:
+            progress(report)
+
+    for number, line in enumerate(lines, 1):
+        if line is None:
+            record = ValueError(f"Строка длиннее {IMPORT_MAX_LINE} байт")
+        else:
+            line = line.strip()
+            if number == 1:
+                line = line.lstrip(b'\xef\xbb\xbf')
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = ValueError(f"Некорректный JSON: {e}")
+        chunk.append(record)
+        numbers.append(number)
+        if len(chunk) >= chunk_size:
+            commit()
+    if chunk:
+        commit()
+    report["took_ms"] = int((time.time() - started) * 1000)
+    return report
+
+
+def parse_batch_body(raw):
+    """Элементы пакета из тела запроса: JSON-массив, {"items": [...]} или NDJSON (объект на строку).
+
+    Ошибка разбора строки NDJSON не отменяет пакет — на её месте остаётся ValueError.
+    """
+    text = raw.decode('utf-8').strip()
+    if text.startswith('['):
+        return json.loads(text)
+    if text.startswith('{'):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None  # не один объект — значит, NDJSON
+        if isinstance(data, dict):
+            return data["items"] if isinstance(data.get("items"), list) else [data]
+    items = []
+    for n, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            items.append(ValueError(f"Строка {n}: {e}"))
+    return items
+
+def save_repairs():
+    """Сохранение заявок в хранилище"""
+    with LOCKS["repairs"]:
+        saved = STORAGE.save_all("repairs", list(REPAIRS_STORAGE))
+        if saved:
+            print(f"💾 Сохранено {len(REPAIRS_STORAGE)} заявок")
+        return saved
+
+# Коллекция -> функция полного сохранения
+COLLECTIONS = {
+    "repairs": save_repairs,
+    "customers": save_customers,
+    "inventory": save_inventory,
+    "appointments": save_appointments,
+    "settings": save_settings,
+}
+
+LOADERS = {
+    "repairs": load_repairs,
+    "customers": load_customers,
+    "inventory": load_inventory,
+    "appointments": load_appointments,
+    "settings": load_settings,
+}
+# Коллекция загружена: до этого её нельзя ни читать, ни сохранять (иначе пустой список затрёт файл)
+LOADED = {name: threading.Event() for name in COLLECTION_NAMES}
+
+
+def ensure_loaded(*collections):
+    """Загружает коллекции, которые ещё не загружены; остальные запросы к ним ждут эту загрузку"""
+    for collection in COLLECTION_NAMES:
+        if collection not in collections or LOADED[collection].is_set():
+            continue
+        with LOCKS[collection]:
+            if LOADED[collection].is_set():
+                continue
+            started = time.time()
+            LOADERS[collection]()
+            with CHANGE_LOCK:
+                REVISIONS[collection] += 1
+                REVISION_TIMES[collection] = datetime.now().isoformat()
+                RESPONSE_CACHE.invalidate(collection)
+            LOADED[collection].set()
+        print(f"📂 {collection}: готово за {int((time.time() - started) * 1000)} мс")
+
+
+def load_all():
+    """Загрузка всех коллекций (заявки первыми — они нужны большинству запросов)"""
+    ensure_loaded(*COLLECTION_NAMES)
+
+
+def build_search_index():
+    """Строит поисковый индекс заявок и клиентов один раз после загрузки.
+
+    Идёт отдельно от загрузки коллекций и без их блокировок (кроме снятия среза),
+    поэтому ждёт его только /api/search; изменения во время построения не теряются.
+    """
+    if SEARCH_READY.is_set():
+        return
+    with SEARCH_BUILD_LOCK:
+        if SEARCH_READY.is_set():
+            return
+        ensure_loaded("repairs", "customers")
+        started = time.time()
+        for kind, collection, records in (("repair", "repairs", lambda: REPAIRS_STORAGE),
+                                          ("customer", "customers", lambda: CUSTOMERS_STORAGE)):
+            with LOCKS[collection]:
+                items = list(records())
+                SEARCH_INDEX.begin_bulk(kind)
+            SEARCH_INDEX.bulk_index(kind, items)
+        SEARCH_READY.set()
+    print(f"🔎 Поисковый индекс: {len(SEARCH_INDEX.documents)} документов за {int((time.time() - started) * 1000)} мс")
+
+
+def warm_up():
+    """Фоновая загрузка: коллекции, затем поисковый индекс"""
+    load_all()
+    build_search_index()
+
+
+# Префикс пути API -> коллекции, загрузки которых ждёт запрос
+PATH_COLLECTIONS = (
+    ("/api/repairs", ("repairs",)),
+    ("/api/stats", ("repairs",)),
+    ("/api/customers", ("repairs", "customers")),
+    ("/api/search", ("repairs", "customers")),
+    ("/api/inventory", ("inventory",)),
+    ("/api/appointments", ("appointments",)),
+    ("/api/settings", ("settings",)),
+    ("/api/changes", COLLECTION_NAMES),
+)
+
+
+def collections_for_request(command, path):
+    path = path.split('?')[0]
+    for prefix, collections in PATH_COLLECTIONS:
+        if path == prefix or path.startswith(prefix + '/'):
+            if prefix == "/api/repairs" and command != 'GET':
+                # изменения заявок обновляют и клиентов
+                return collections + ("customers",)
+            return collections
+    return ()
+
+
+class EventSubscriber:
+    """Клиент /api/events: ограниченный буфер готовых SSE-кадров.
+
+    Если клиент не успевает читать и буфер переполнен, соединение закрывается —
+    EventSource переподключится с Last-Event-ID и дочитает пропущенное из истории.
+    """
+
+    def __init__(self, collections=None, limit=EVENTS_CLIENT_BUFFER):
+        self.collections = collections
+        self.limit = max(1, limit)
+        self.buffer = deque()
+        self.overflowed = False
+        self.closed = False
+        self.cond = threading.Condition()
+        self.wakeup = None
+
+    def push(self, collection, frame):
+        """Кадр для клиента; collection=None — служебный кадр (resync), он идёт мимо фильтра коллекций"""
+        if collection is not None and self.collections and collection not in self.collections:
+            return
+        with self.cond:
+            if len(self.buffer) >= self.limit:
+                self.overflowed = True
+            else:
+                self.buffer.append(frame)
+            self.cond.notify()
+        if self.wakeup:
+            self.wakeup()
+
+    def close(self):
+        """Сервер останавливается: поток событий клиента заканчивается (EventSource переподключится)"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        if self.wakeup:
+            self.wakeup()
+
+    def drain(self):
+        """Накопленные кадры; None — буфер переполнялся или подписка закрыта, соединение нужно закрыть"""
+        with self.cond:
+            if self.overflowed or self.closed:
+                return None
+            frames = list(self.buffer)
+            self.buffer.clear()
+            return frames
+
+    def wait(self, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.buffer or self.overflowed or self.closed, timeout)
+        return self.drain()
+
+
+class EventBus:
+    """Рассылка изменений коллекций подписчикам /api/events с короткой историей для переподключений"""
+
+    def __init__(self, history=EVENTS_HISTORY):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.history = deque(maxlen=max(1, history))
+        self.last_id = CHANGE_BASE
+
+    def publish(self, seq, collection, event, item):
+        """Рассылает изменение; id события — его номер в последовательности изменений"""
+        with self.lock:
+            self.last_id = seq
+            payload = {
+                "seq": seq,
+                "collection": collection,
+                "type": event,
+                "id": item.get("id") if collection != "settings" else None,
+                "item": item if event != "delete" else None,
+                "timestamp": datetime.now().isoformat(),
+            }
+            data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+            frame = f"id: {self.last_id}\ndata: {data}\n\n".encode('utf-8')
+            self.history.append((self.last_id, collection, frame))
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.push(collection, frame)
+
+    def subscribe(self, collections=None, last_event_id=None, limit=None):
+        """Новый подписчик; None — подписчиков уже limit"""
+        subscriber = EventSubscriber(collections)
+        with self.lock:
+            if limit is not None and len(self.subscribers) >= limit:
+                return None
+            if last_event_id is not None and last_event_id != self.last_id:
+                oldest = self.history[0][0] if self.history else self.last_id + 1
+                if last_event_id < self.last_id and last_event_id + 1 >= oldest:
+                    for event_id, collection, frame in self.history:
+                        if event_id > last_event_id:
+                            subscriber.push(collection, frame)
+                else:
+                    # История не покрывает пропуск (или сервер перезапускался) — клиенту нужна
+                    # полная перезагрузка или дочитывание через /api/changes
+                    data = json.dumps({"type": "resync", "last_id": self.last_id})
+                    subscriber.push(None, f"id: {self.last_id}\ndata: {data}\n\n".encode('utf-8'))
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def close_all(self):
+        """Закрывает потоки всех подписчиков (остановка сервера)"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+
+
+EVENTS = EventBus()
+
+SSE_RETRY = b"retry: 3000\n\n"
+SSE_HEARTBEAT = b": ping\n\n"
+
+
+def _pump_events(sock, subscriber):
+    """Поток, отдающий события подписчику в потоковых режимах single/pool"""
+    try:
+        sock.sendall(SSE_RETRY)
+        while True:
+            frames = subscriber.wait(EVENTS_HEARTBEAT)
+            if frames is None:
+                break
+            sock.sendall(b"".join(frames) or SSE_HEARTBEAT)
+    except OSError:
+        pass
+    finally:
+        EVENTS.unsubscribe(subscriber)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+
+class ResponseCache:
+    """Готовые (сериализованные и сжатые) ответы списков с LRU-вытеснением по объёму.
+
+    Ключ — путь, параметры запроса и принимаемое сжатие. Запись помнит, от каких коллекций
+    она зависит: record_change() сбрасывает ровно их. Дополнительно запись отдаётся только
+    при совпадении ETag, поэтому ответ, собранный во время параллельного изменения, не выживет.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.by_collection = {}
+        self.size = 0
+
+    def get(self, key, etag):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self.entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, etag, collections, response):
+        body = response[0]
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = (etag, collections, response)
+            self.size += len(body)
+            for collection in collections:
+                self.by_collection.setdefault(collection, set()).add(key)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def invalidate(self, collection):
+        with self.lock:
+            for key in self.by_collection.pop(collection, ()):
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry[2][0])
+        for collection in entry[1]:
+            keys = self.by_collection.get(collection)
+            if keys:
+                keys.discard(key)
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+class GroupCommitter:
+    """Фоновое сохранение изменённых (dirty) коллекций с объединением записей.
+
+    record_change() только помечает коллекцию; поток-флашер сохраняет её целиком,
+    когда окно PERSIST_WINDOW прошло без изменений или данные не сохранены уже PERSIST_MAX_DELAY.
+    flush() сохраняет немедленно в вызывающем потоке — для тех, кому нужна долговечность.
+    """
+
+    def __init__(self, window=PERSIST_WINDOW, max_delay=PERSIST_MAX_DELAY):
+        self.window = window
+        self.max_delay = max(window, max_delay)
+        self.cond = threading.Condition()
+        # коллекция -> (время первого несохранённого изменения, время последнего)
+        self.dirty = {}
+        self.thread = None
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def mark(self, collection):
+        now = time.monotonic()
+        with self.cond:
+            first = self.dirty.get(collection, (now, now))[0]
+            self.dirty[collection] = (first, now)
+            self.cond.notify()
+
+    def flush(self, collections=None):
+        """Сохраняет грязные коллекции сейчас; True — всё записано"""
+        ok = True
+        with self.cond:
+            taken = [c for c in COLLECTION_NAMES if c in self.dirty and (collections is None or c in collections)]
+            marks = {c: self.dirty.pop(c) for c in taken}
+        for collection in taken:
+            with LOCKS[collection]:
+                saved = COLLECTIONS[collection]()
+            if saved is False:
+                ok = False
+                with self.cond:
+                    # не записалось — остаётся грязной, флашер повторит
+                    self.dirty.setdefault(collection, marks[collection])
+        return ok
+
+    def _due(self, now):
+        due, wait = [], None
+        for collection, (first, last) in self.dirty.items():
+            deadline = min(first + self.max_delay, last + self.window)
+            if deadline <= now:
+                due.append(collection)
+            elif wait is None or deadline - now < wait:
+                wait = deadline - now
+        return due, wait
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                due, wait = self._due(time.monotonic())
+                if not due:
+                    self.cond.wait(wait)
+                    continue
+            if not self.flush(due):
+                time.sleep(self.window)
+
+    def start(self):
+        if self.enabled and self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="group-commit", daemon=True)
+            self.thread.start()
+
+
+PERSISTER = GroupCommitter()
+
+
+def record_change(collection, op, item, event=None):
+    """Фиксирует изменение записи коллекции.
+
+    op: 'put' (создание/обновление), 'del' (удаление), 'set' (настройки целиком).
+    Журнал и SQLite пишут одну запись; JSON без журнала переписывает коллекцию целиком —
+    через PERSISTER, который объединяет частые изменения в одну запись.
+    event — тип события для /api/events (create, update, status, delete); по умолчанию из op.
+    Возвращает номер изменения в глобальной последовательности.
+    """
+    return record_changes(collection, op, [item], event)
+
+
+def record_changes(collection, op, items, event=None):
+    """Фиксирует изменения нескольких записей коллекции одной записью в хранилище.
+
+    event — тип события для всех записей или список типов по записям.
+    Каждая запись получает свой номер изменения и событие; возвращает номер последнего.
+    """
+    default = "delete" if op == "del" else "update"
+    with LOCKS[collection]:
+        records = record_list(collection)
+        if records is not None and op != "del":
+            for item in items:
+                records.touch(item.get("id"))
+        if not STORAGE.append(collection, op, items):
+            # несохранённая коллекция остаётся грязной: flush() для ?durable=1 повторит запись
+            # и, если она снова не удастся, запрос получит 500
+            if PERSISTER.enabled or COLLECTIONS[collection]() is False:
+                PERSISTER.mark(collection)
+        with CHANGE_LOCK:
+            for i, item in enumerate(items):
+                record_id = item.get("id") if collection != "settings" else None
+                seq = _log_change(collection, record_id, "del" if op == "del" else "put")
+                item_event = event[i] if isinstance(event, list) else event
+                EVENTS.publish(seq, collection, item_event or default, item)
+            REVISIONS[collection] += 1
+            REVISION_TIMES[collection] = datetime.now().isoformat()
+            RESPONSE_CACHE.invalidate(collection)
+    return seq
+
+
+def record_list(collection):
+    """RecordList коллекции (None для настроек); имена *_STORAGE переприсваиваются при загрузке"""
+    return {"repairs": REPAIRS_STORAGE, "customers": CUSTOMERS_STORAGE,
+            "inventory": INVENTORY_STORAGE, "appointments": APPOINTMENTS_STORAGE}.get(collection)
+
+
+class Snapshot:
+    """Неизменяемый срез для читателей: копии записей на момент ревизий revisions"""
+
+    __slots__ = ("revisions", "items", "changed_at", "etag")
+
+    def __init__(self, collections, items):
+        self.revisions = tuple(REVISIONS[c] for c in collections)
+        self.items = items
+        self.changed_at = collections_changed_at(*collections)
+        self.etag = collections_etag(*collections)
+
+
+def _customer_view(customer):
+    return dict(customer, **customer_repairs_summary(customer))
+
+
+# Срез -> (коллекции, от которых он зависит, построение кортежа копий записей).
+# Копии снимаются заново только у изменённых записей (RecordList.frozen)
+SNAPSHOT_BUILDERS = {
+    "repairs": (("repairs",), lambda: REPAIRS_STORAGE.frozen()),
+    "customers": (("repairs", "customers"), lambda: CUSTOMERS_STORAGE.frozen(_customer_view)),
+    "inventory": (("inventory",), lambda: INVENTORY_STORAGE.frozen()),
+    "appointments": (("appointments",), lambda: APPOINTMENTS_STORAGE.frozen()),
+}
+_SNAPSHOTS = {}
+
+
+def snapshot(name):
+    """Актуальный срез; перестраивается лениво, один раз на ревизию.
+
+    Читатель не ждёт писателя: если блокировка коллекции занята, а срез уже есть,
+    отдаётся предыдущий целостный срез (его ETag соответствует его содержимому).
+    """
+    collections, build = SNAPSHOT_BUILDERS[name]
+    current = _SNAPSHOTS.get(name)
+    if current is not None and current.revisions == tuple(REVISIONS[c] for c in collections):
+        return current
+    acquired = []
+    try:
+        for collection in COLLECTION_NAMES:
+            if collection in collections:
+                if not LOCKS[collection].acquire(blocking=current is None):
+                    return current
+                acquired.append(LOCKS[collection])
+        current = Snapshot(collections, build())
+        _SNAPSHOTS[name] = current
+        return current
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
+
+
+def copy_record(collection, record_id):
+    """Копия записи по id (настройки — целиком), снятая под блокировкой коллекции"""
+    with LOCKS[collection]:
+        if collection == "settings":
+            return dict(SETTINGS_STORAGE)
+        item = record_list(collection).index.get(record_id)
+        return dict(item) if item is not None else None
+
+
+def changes_since(since, collections=None, limit=DEFAULT_CHANGES_LIMIT):
+    """Изменения с номером больше since, по возрастанию; у удалённых записей — tombstone.
+
+    Если since старше начала журнала (другой запуск сервера) или больше текущего номера
+    (номер не из этой последовательности, например, до восстановления данных из копии),
+    reset=True: клиент должен сбросить локальные данные и принять ответ как полный набор.
+    """
+    with CHANGE_LOCK:
+        current_seq = CHANGE_SEQ
+        collected = []
+        for (collection, record_id), (seq, op) in reversed(CHANGE_LOG.items()):
+            if seq <= since:
+                break
+            if collections and collection not in collections:
+                continue
+            collected.append((seq, collection, record_id, op))
+    collected.reverse()
+    has_more = len(collected) > limit
+    changes = []
+    # Записи читаются уже после CHANGE_LOCK (порядок блокировок) — могут оказаться новее seq,
+    # повторное изменение клиент всё равно получит следующим запросом
+    for seq, collection, record_id, op in collected[:limit]:
+        change = {"seq": seq, "collection": collection, "id": record_id}
+        item = copy_record(collection, record_id) if op != "del" else None
+        if item is None:
+            change["deleted"] = True
+        else:
+            change["item"] = item
+        changes.append(change)
+    return {
+        "since": since,
+        "reset": since < CHANGE_BASE or since > current_seq,
+        "seq": changes[-1]["seq"] if has_more else current_seq,
+        "has_more": has_more,
+        "changes": changes,
+    }
+
+
+def collections_etag(*collections, extra=None):
+    """Сильный ETag представления, зависящего от перечисленных коллекций"""
+    parts = [BOOT_ID] + [str(REVISIONS[c]) for c in collections]
+    if extra:
+        parts.append(extra)
+    return '"' + "-".join(parts) + '"'
+
+
+def collections_changed_at(*collections):
+    """Время последнего изменения коллекций (время запуска, если изменений не было)"""
+    return max(REVISION_TIMES.get(c, STARTED_AT) for c in collections)
+
 
-CUSTOMERS_STORAGE = []
-INVENTORY_STORAGE = []
-APPOINTMENTS_STORAGE = []
-SETTINGS_STORAGE = {}
+def checkpoint(collection):
+    """Сворачивает журнал коллекции в снапшот"""
+    with LOCKS[collection]:
+        if LOADED[collection].is_set() and STORAGE.needs_snapshot(collection):
+            COLLECTIONS[collection]()
 
 
-def _load_json_file(path, default):
-    try:
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return default
-    except Exception as e:
-        print(f"❌ Ошибка чтения {path}: {e}")
-        return default
+def checkpoint_all():
+    for collection in COLLECTIONS:
+        checkpoint(collection)
 
 
-def _save_json_file(path, data):
-    try:
-        with LOCK:
-            with open(path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"❌ Ошибка записи {path}: {e}")
+def _checkpoint_loop():
+    while True:
+        time.sleep(JOURNAL_CHECKPOINT_INTERVAL)
+        for collection in COLLECTIONS:
+            if STORAGE.pending(collection):
+                checkpoint(collection)
 
-def load_repairs():
-    """Загрузка заявок из файла"""
-    global REPAIRS_STORAGE
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                REPAIRS_STORAGE = data.get('repairs', [])
-                print(f"📂 Загружено {len(REPAIRS_STORAGE)} заявок из файла")
-        else:
-            # Создаем демо-данные при первом запуске
-            REPAIRS_STORAGE = [
-                {
-                    "id": "repair_001",
-                    "firstName": "Алексей",
-                    "lastName": "Петров",
-                    "phone": "+7 (999) 123-45-67",
-                    "email": "alex@example.com",
-                    "deviceType": "smartphone",
-                    "deviceBrand": "iPhone 14 Pro",
-                    "problemType": "screen",
-                    "urgency": "high",
-                    "address": "ул. Ленина, 15, кв. 42",
-                    "description": "Разбился экран после падения. Тачскрин не работает.",
-                    "status": "new",
-                    "timestamp": "2026-01-22T10:30:00Z",
-                    "source": "demo"
-                },
-                {
-                    "id": "repair_002",
-                    "firstName": "Мария",
-                    "lastName": "Сидорова",
-                    "phone": "+7 (999) 987-65-43",
-                    "email": "maria@example.com",
-                    "deviceType": "laptop",
-                    "deviceBrand": "HP Pavilion 15",
-                    "problemType": "performance",
-                    "urgency": "medium",
-                    "address": "пр. Мира, 88",
-                    "description": "Ноутбук очень медленно работает, долго загружается.",
-                    "status": "in-progress",
-                    "timestamp": "2026-01-21T14:15:00Z",
-                    "source": "demo"
-                }
-            ]
-            save_repairs()
-            print(f"📝 Созданы демо-данные: {len(REPAIRS_STORAGE)} заявок")
-    except Exception as e:
-        print(f"❌ Ошибка загрузки данных: {e}")
-        REPAIRS_STORAGE = []
 
-    # Загружаем остальные данные CRM
-    load_customers()
-    load_inventory()
-    load_appointments()
-    load_settings()
+def start_journal_checkpointer():
+    """Фоновый периодический чекпоинт журналов"""
+    if STORAGE_JOURNAL and isinstance(STORAGE, JsonFileStorage):
+        threading.Thread(target=_checkpoint_loop, name="journal-checkpoint", daemon=True).start()
 
 
-def load_customers():
-    global CUSTOMERS_STORAGE
-    data = _load_json_file(CUSTOMERS_FILE, {"items": []})
-    CUSTOMERS_STORAGE = data.get("items", []) if isinstance(data, dict) else (data or [])
+class Asset:
+    """Закэшированный файл: байты, gzip-вариант и валидаторы"""
 
+    __slots__ = ("path", "mtime_ns", "size", "content_type", "body", "gzip_body", "etag", "last_modified")
 
-def save_customers():
-    _save_json_file(CUSTOMERS_FILE, {"items": CUSTOMERS_STORAGE, "last_updated": datetime.now().isoformat(), "total": len(CUSTOMERS_STORAGE)})
+    def __init__(self, path, stat, content_type):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.content_type = content_type
+        self.body = None
+        self.gzip_body = None
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
 
 
-def load_inventory():
-    global INVENTORY_STORAGE
-    data = _load_json_file(INVENTORY_FILE, {"items": []})
-    INVENTORY_STORAGE = data.get("items", []) if isinstance(data, dict) else (data or [])
+class AssetCache:
+    """Кэш HTML и статики в памяти с проверкой mtime на каждом запросе.
 
+    Небольшие файлы хранятся байтами вместе с заранее сжатым gzip-вариантом; при изменении
+    mtime или размера файл перечитывается. Большие файлы (от STATIC_SENDFILE_MIN) в памяти
+    не держатся — для них кэшируются только валидаторы, а тело отдаётся через sendfile.
+    """
 
-def save_inventory():
-    _save_json_file(INVENTORY_FILE, {"items": INVENTORY_STORAGE, "last_updated": datetime.now().isoformat(), "total": len(INVENTORY_STORAGE)})
+    TYPES = {
+        ".html": "text/html; charset=utf-8",
+        ".css": "text/css",
+        ".js": "application/javascript",
+        ".png": "image/png",
+        ".jpg": "image/jpeg",
+        ".jpeg": "image/jpeg",
+        ".svg": "image/svg+xml",
+    }
+    COMPRESSIBLE = (".html", ".css", ".js", ".svg")
 
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.assets = {}
 
-def load_appointments():
-    global APPOINTMENTS_STORAGE
-    data = _load_json_file(APPOINTMENTS_FILE, {"items": []})
-    APPOINTMENTS_STORAGE = data.get("items", []) if isinstance(data, dict) else (data or [])
+    def get(self, filename):
+        """Актуальная запись для файла или None, если файла нет (или путь ведёт за пределы каталога)"""
+        parts = filename.replace("\\", "/").split("/")
+        if os.path.isabs(filename) or ".." in parts:
+            return None
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        asset = self.assets.get(filename)
+        if asset and asset.mtime_ns == stat.st_mtime_ns and asset.size == stat.st_size:
+            return asset
+        ext = os.path.splitext(filename)[1].lower()
+        asset = Asset(filename, stat, self.TYPES.get(ext, "application/octet-stream"))
+        if stat.st_size < STATIC_SENDFILE_MIN:
+            with open(filename, "rb") as f:
+                asset.body = f.read()
+            asset.size = len(asset.body)
+            if ext in self.COMPRESSIBLE and asset.size >= COMPRESS_MIN_SIZE:
+                compressor = zlib.compressobj(9, zlib.DEFLATED, COMPRESS_WBITS["gzip"])
+                asset.gzip_body = compressor.compress(asset.body) + compressor.flush()
+        with self.lock:
+            self.assets[filename] = asset
+        return asset
 
 
-def save_appointments():
-    _save_json_file(APPOINTMENTS_FILE, {"items": APPOINTMENTS_STORAGE, "last_updated": datetime.now().isoformat(), "total": len(APPOINTMENTS_STORAGE)})
+ASSETS = AssetCache()
 
 
-def load_settings():
-    global SETTINGS_STORAGE
-    data = _load_json_file(SETTINGS_FILE, {})
-    SETTINGS_STORAGE = data if isinstance(data, dict) else {}
+class RequestBody(ABC):
+    """Тело запроса, читаемое по мере надобности: Content-Length или Transfer-Encoding: chunked.
 
+    Подклассы задают источник байтов: _read(size) и _readline().
+    """
 
-def save_settings():
-    _save_json_file(SETTINGS_FILE, SETTINGS_STORAGE)
+    piece_size = 64 * 1024
 
+    def __init__(self, headers):
+        self.chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self.remaining = 0 if self.chunked else int(headers.get('Content-Length', 0) or 0)
+        self.finished = not self.chunked and self.remaining <= 0
 
-def _customer_key(phone: str, email: str):
-    phone = (phone or "").strip()
-    email = (email or "").strip().lower()
-    return phone or email or None
+    @abstractmethod
+    def _read(self, size):
+        """До size байт тела (chunked — ровно size)"""
 
+    @abstractmethod
+    def _readline(self):
+        """Строка служебной разметки chunked (размер куска, trailer)"""
 
-def upsert_customer_from_repair(repair: dict):
-    """Создаёт/обновляет клиента по заявке (по телефону или email)"""
-    key = _customer_key(repair.get("phone"), repair.get("email"))
-    if not key:
-        return
-    with LOCK:
-        existing = None
-        for c in CUSTOMERS_STORAGE:
-            if _customer_key(c.get("phone"), c.get("email")) == key:
-                existing = c
+    def _next_piece(self):
+        if self.finished:
+            return b''
+        if self.chunked:
+            size = int(self._readline().split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                # trailer-заголовки до пустой строки
+                while self._readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                self.finished = True
+                return b''
+            data = self._read(size)
+            self._readline()
+            return data
+        data = self._read(min(self.piece_size, self.remaining))
+        self.remaining -= len(data)
+        if not data or self.remaining <= 0:
+            self.finished = True
+        return data
+
+    def lines(self, max_line=IMPORT_MAX_LINE):
+        """Строки тела по одной (без перевода строки); строка длиннее max_line отдаётся как None, не накапливаясь"""
+        buffer = bytearray()
+        skipping = False
+        while True:
+            piece = self._next_piece()
+            if not piece:
                 break
-        if existing:
-            # обновляем контактные данные/имя, но не затираем явно заполненное пустым
-            for field in ("firstName", "lastName", "phone", "email"):
-                v = repair.get(field)
-                if v:
-                    existing[field] = v
-            existing["updated_at"] = datetime.now().isoformat()
-        else:
-            CUSTOMERS_STORAGE.insert(0, {
-                "id": str(uuid.uuid4()),
-                "firstName": repair.get("firstName", ""),
-                "lastName": repair.get("lastName", ""),
-                "phone": repair.get("phone", ""),
-                "email": repair.get("email", ""),
-                "note": "",
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat(),
-            })
-    save_customers()
+            buffer += piece
+            start = 0
+            while True:
+                end = buffer.find(b'\n', start)
+                if end < 0:
+                    break
+                yield None if skipping else bytes(buffer[start:end])
+                skipping = False
+                start = end + 1
+            del buffer[:start]
+            if len(buffer) > max_line:
+                skipping = True
+                buffer.clear()
+        if skipping:
+            yield None
+        elif buffer:
+            yield bytes(buffer)
+
+
+class SocketRequestBody(RequestBody):
+    def __init__(self, rfile, headers):
+        super().__init__(headers)
+        self.rfile = rfile
+
+    def _read(self, size):
+        return self.rfile.read(size)
+
+    def _readline(self):
+        return self.rfile.readline(65537)
 
-def save_repairs():
-    """Сохранение заявок в файл"""
-    try:
-        with LOCK:
-            data = {
-                "repairs": REPAIRS_STORAGE,
-                "last_updated": datetime.now().isoformat(),
-                "total": len(REPAIRS_STORAGE)
-            }
-            with open(DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"💾 Сохранено {len(REPAIRS_STORAGE)} заявок")
-    except Exception as e:
-        print(f"❌ Ошибка сохранения: {e}")
 
 class ProductionHandler(BaseHTTPRequestHandler):
+    # Тела этих запросов не читаются заранее — обработчик разбирает их потоково
+    STREAMING_UPLOADS = ('/api/repairs/import',)
+
     
     def log_message(self, format, *args):
         """Логирование с временной меткой"""
@@ -210,7 +2375,8 @@ class ProductionHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Обработка GET запросов"""
         try:
-            path = self.path.split('?')[0]  # Убираем query параметры
+            ensure_loaded(*collections_for_request(self.command, self.path))
+            path = urlsplit(self.path).path  # Убираем query параметры
             
             # Главная страница
             if path == '/' or path == '/index.html':
@@ -220,6 +2386,10 @@ class ProductionHandler(BaseHTTPRequestHandler):
             elif path == '/api/repairs':
                 self.send_repairs_api()
             
+            # Выгрузка заявок
+            elif path == '/api/repairs/export':
+                self.send_repairs_export()
+            
             # Конкретная заявка
             elif path.startswith('/api/repairs/') and not path.endswith('/status'):
                 repair_id = path.split('/')[-1]
@@ -247,6 +2417,12 @@ class ProductionHandler(BaseHTTPRequestHandler):
                 self.send_appointment_by_id(appt_id)
             elif path == '/api/settings':
                 self.send_settings_api()
+            elif path == '/api/search':
+                self.send_search_api()
+            elif path == '/api/events':
+                self.send_event_stream()
+            elif path == '/api/changes':
+                self.send_changes_api()
             
             # HTML файлы
             elif path.endswith('.html'):
@@ -270,12 +2446,19 @@ class ProductionHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         """Обработка POST запросов"""
         try:
-            path = self.path
+            ensure_loaded(*collections_for_request(self.command, self.path))
+            path = urlsplit(self.path).path
             
             if path == '/api/repairs':
                 self.create_repair()
+            elif path == '/api/repairs/batch':
+                self.create_repairs_batch()
+            elif path == '/api/repairs/import':
+                self.import_repairs()
             elif path == '/api/customers':
                 self.create_customer()
+            elif path == '/api/customers/batch':
+                self.create_customers_batch()
             elif path == '/api/inventory':
                 self.create_inventory_item()
             elif path == '/api/appointments':
@@ -290,9 +2473,12 @@ class ProductionHandler(BaseHTTPRequestHandler):
     def do_PUT(self):
         """Обработка PUT запросов"""
         try:
-            path = self.path
+            ensure_loaded(*collections_for_request(self.command, self.path))
+            path = urlsplit(self.path).path
             
-            if '/api/repairs/' in path and '/status' in path:
+            if path == '/api/repairs/status':
+                self.update_repair_statuses()
+            elif '/api/repairs/' in path and '/status' in path:
                 self.update_repair_status()
             elif path.startswith('/api/repairs/'):
                 self.update_repair()
@@ -314,7 +2500,8 @@ class ProductionHandler(BaseHTTPRequestHandler):
     def do_DELETE(self):
         """Обработка DELETE запросов"""
         try:
-            path = self.path
+            ensure_loaded(*collections_for_request(self.command, self.path))
+            path = urlsplit(self.path).path
             
             if path.startswith('/api/repairs/'):
                 self.delete_repair()
@@ -336,7 +2523,7 @@ class ProductionHandler(BaseHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization, If-None-Match')
         self.end_headers()
     
     def create_repair(self):
@@ -348,29 +2535,13 @@ class ProductionHandler(BaseHTTPRequestHandler):
                 data = json.loads(post_data.decode('utf-8'))
                 
                 # Создаем новую заявку
-                new_repair = {
-                    "id": str(uuid.uuid4()),
-                    "firstName": data.get('firstName', ''),
-                    "lastName": data.get('lastName', ''),
-                    "phone": data.get('phone', ''),
-                    "email": data.get('email', ''),
-                    "deviceType": data.get('deviceType', ''),
-                    "deviceBrand": data.get('deviceBrand', ''),
-                    "problemType": data.get('problemType', ''),
-                    "urgency": data.get('urgency', 'low'),
-                    "address": data.get('address', ''),
-                    "description": data.get('description', ''),
-                    "status": "new",
-                    "timestamp": datetime.now().isoformat(),
-                    "source": "repair_landing"
-                }
-                
-                # Добавляем в начало списка
-                with LOCK:
-                    REPAIRS_STORAGE.insert(0, new_repair)
+                new_repair = build_repair(data)
                 
-                # Сохраняем в файл
-                save_repairs()
+                # Добавляем в начало списка и сохраняем
+                with LOCKS["repairs"]:
+                    REPAIRS_STORAGE.insert(new_repair)
+                    _index_repair(new_repair)
+                    record_change("repairs", "put", new_repair, "create")
                 # Обновляем клиентов
                 upsert_customer_from_repair(new_repair)
                 
@@ -384,41 +2555,115 @@ class ProductionHandler(BaseHTTPRequestHandler):
             else:
                 self.send_json_response({"error": "Нет данных"}, 400)
                 
+        except ValueError as e:
+            self.send_json_response({"error": f"Ошибка создания заявки: {str(e)}"}, 400)
         except Exception as e:
             print(f"❌ Ошибка создания заявки: {e}")
             self.send_json_response({"error": f"Ошибка создания заявки: {str(e)}"}, 500)
     
+    def read_batch(self):
+        """Элементы пакетного запроса или None, если уже отправлен ответ с ошибкой"""
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length <= 0:
+            self.send_json_response({"error": "Нет данных"}, 400)
+            return None
+        try:
+            items = parse_batch_body(self.rfile.read(content_length))
+        except (ValueError, KeyError, AttributeError) as e:
+            self.send_json_response({"error": f"Не удалось разобрать пакет: {e}"}, 400)
+            return None
+        if not items:
+            self.send_json_response({"error": "Пустой пакет"}, 400)
+            return None
+        if len(items) > BATCH_MAX_ITEMS:
+            self.send_json_response({"error": f"Не больше {BATCH_MAX_ITEMS} записей в пакете"}, 413)
+            return None
+        return items
+
+    def send_batch_results(self, results, label):
+        failed = sum(1 for r in results if r["status"] == "error")
+        done = len(results) - failed
+        print(f"📦 Пакет {label}: {done} из {len(results)}" + (f", ошибок: {failed}" if failed else ""))
+        self.send_json_response({
+            "status": "success" if not failed else ("partial" if done else "error"),
+            "total": len(results),
+            "succeeded": done,
+            "failed": failed,
+            "results": results,
+        }, 200 if done else 400)
+
+    def create_repairs_batch(self):
+        """Пакетное создание заявок (перенос истории, интеграции): JSON-массив или NDJSON"""
+        try:
+            items = self.read_batch()
+            if items is not None:
+                self.send_batch_results(create_repairs(items), "заявок")
+        except Exception as e:
+            print(f"❌ Ошибка пакетного создания заявок: {e}")
+            self.send_json_response({"error": str(e)}, 500)
+
+    def open_request_body(self):
+        return SocketRequestBody(self.rfile, self.headers)
+
+    def import_repairs(self):
+        """Импорт NDJSON: POST /api/repairs/import, тело разбирается построчно по мере получения.
+
+        Ход импорта пишется в лог после каждого куска, в ответе — итоговый отчёт.
+        """
+        try:
+            body = self.open_request_body()
+            print("📥 Импорт заявок начат")
+
+            def progress(report):
+                print(f"📥 Импорт: {report['processed']} строк, создано {report['created']}, "
+                      f"пропущено {report['skipped']}, ошибок {report['failed']}")
+
+            report = import_repairs(body.lines(), progress=progress)
+            if not body.finished:
+                # тело не дочитано (обрыв) — соединение переиспользовать нельзя
+                self.close_connection = True
+            print(f"✅ Импорт завершён за {report['took_ms']} мс: создано {report['created']}")
+            report["status"] = "success" if not report["failed"] else "partial"
+            self.send_json_response(report)
+        except Exception as e:
+            print(f"❌ Ошибка импорта заявок: {e}")
+            self.close_connection = True
+            self.send_json_response({"error": str(e)}, 500)
+
     def update_repair_status(self):
         """Обновление статуса заявки"""
         try:
-            repair_id = self.path.split('/')[-2]
+            repair_id = self.path_id(-2)
             
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length > 0:
                 post_data = self.rfile.read(content_length)
                 data = json.loads(post_data.decode('utf-8'))
-                new_status = data.get('status')
+                try:
+                    new_status = _repair_status(data.get('status') if isinstance(data, dict) else None)
+                except ValueError as e:
+                    self.send_json_response({"error": str(e)}, 400)
+                    return
                 
                 # Находим и обновляем заявку
-                with LOCK:
-                    for repair in REPAIRS_STORAGE:
-                        if repair['id'] == repair_id:
-                            old_status = repair['status']
-                            repair['status'] = new_status
-                            repair['updated_at'] = datetime.now().isoformat()
-                            
-                            if new_status == 'completed':
-                                repair['completion_date'] = datetime.now().isoformat()
-                            
-                            save_repairs()
-                            
-                            print(f"🔄 Статус заявки {repair_id}: {old_status} → {new_status}")
-                            
-                            self.send_json_response({
-                                "status": "success",
-                                "message": f"Статус изменен на '{new_status}'"
-                            })
-                            return
+                with LOCKS["repairs"]:
+                    repair = REPAIRS_INDEX.get(repair_id)
+                    if repair:
+                        old_status = repair['status']
+                        _unindex_repair(dict(repair))
+                        _set_repair_status(repair, new_status, datetime.now().isoformat())
+                        _index_repair(repair)
+                        
+                        record_change("repairs", "put", repair, "status")
+                
+                if repair:
+                    print(f"🔄 Статус заявки {repair_id}: {old_status} → {new_status}")
+                    
+                    self.send_json_response({
+                        "status": "success",
+                        "message": f"Статус изменен на '{new_status}'"
+                    })
+                    return
                 
                 self.send_json_response({"error": "Заявка не найдена"}, 404)
             else:
@@ -428,21 +2673,51 @@ class ProductionHandler(BaseHTTPRequestHandler):
             print(f"❌ Ошибка обновления статуса: {e}")
             self.send_json_response({"error": str(e)}, 500)
     
+    def update_repair_statuses(self):
+        """Массовая смена статусов: {"ids": [...], "status", "technician"?} или {"items": [{"id", "status", "technician"?}]}"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length <= 0:
+                self.send_json_response({"error": "Нет данных"}, 400)
+                return
+            data = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            if isinstance(data, dict) and isinstance(data.get("ids"), list):
+                changes = [{"id": repair_id, "status": data.get("status"), "technician": data.get("technician")}
+                           for repair_id in data["ids"]]
+            elif isinstance(data, dict) and isinstance(data.get("items"), list):
+                changes = data["items"]
+            else:
+                self.send_json_response({"error": "Ожидается ids или items"}, 400)
+                return
+            if not changes:
+                self.send_json_response({"error": "Пустой список заявок"}, 400)
+                return
+            if len(changes) > BATCH_MAX_ITEMS:
+                self.send_json_response({"error": f"Не больше {BATCH_MAX_ITEMS} заявок в запросе"}, 413)
+                return
+            self.send_batch_results(update_repair_statuses(changes), "статусов")
+        except Exception as e:
+            print(f"❌ Ошибка массовой смены статусов: {e}")
+            self.send_json_response({"error": str(e)}, 500)
+
     def delete_repair(self):
         """Удаление заявки"""
         try:
-            repair_id = self.path.split('/')[-1]
+            repair_id = self.path_id()
             
-            with LOCK:
-                original_length = len(REPAIRS_STORAGE)
-                REPAIRS_STORAGE[:] = [r for r in REPAIRS_STORAGE if r['id'] != repair_id]
+            with LOCKS["repairs"]:
+                repair = REPAIRS_INDEX.get(repair_id)
                 
-                if len(REPAIRS_STORAGE) < original_length:
-                    save_repairs()
-                    print(f"🗑️ Заявка удалена: {repair_id}")
-                    self.send_json_response({"status": "success", "message": "Заявка удалена"})
-                else:
-                    self.send_json_response({"error": "Заявка не найдена"}, 404)
+                if repair:
+                    _unindex_repair(repair)
+                    REPAIRS_STORAGE.remove(repair_id)
+                    record_change("repairs", "del", repair)
+            
+            if repair:
+                print(f"🗑️ Заявка удалена: {repair_id}")
+                self.send_json_response({"status": "success", "message": "Заявка удалена"})
+            else:
+                self.send_json_response({"error": "Заявка не найдена"}, 404)
                     
         except Exception as e:
             print(f"❌ Ошибка удаления: {e}")
@@ -460,27 +2735,62 @@ class ProductionHandler(BaseHTTPRequestHandler):
     def send_repairs_api(self):
         """API для получения заявок"""
         try:
-            # Фильтрация и поиск (если нужно)
-            query_params = self.path.split('?')[1] if '?' in self.path else ''
-            
-            response = {
-                "items": REPAIRS_STORAGE,
-                "total": len(REPAIRS_STORAGE),
-                "page": 1,
-                "per_page": 50,
-                "timestamp": datetime.now().isoformat()
-            }
+            # Фильтрация, сортировка и пагинация
+            try:
+                query = parse_repairs_query(self.query_params())
+            except ValueError as e:
+                self.send_json_response({"error": f"Неверные параметры: {e}"}, 400)
+                return
+            # Срез читается без ожидания писателей; ETag — его ревизии
+            snap = snapshot("repairs")
+            etag = snap.etag
+            if self.not_modified(etag):
+                return
+
+            def build():
+                items, total = query_repairs(query, snap.items)
+                limit, offset = query["limit"], query["offset"]
+                return {
+                    "items": items,
+                    "total": total,
+                    "page": offset // limit + 1 if limit else 1,
+                    "per_page": limit or total,
+                    "offset": offset,
+                    "timestamp": snap.changed_at
+                }
             
-            self.send_json_response(response)
+            self.send_cached_json(etag, ("repairs",), build)
             
         except Exception as e:
             print(f"❌ Ошибка API заявок: {e}")
             self.send_json_response({"error": str(e)}, 500)
     
+    def send_repairs_export(self):
+        """Выгрузка заявок: GET /api/repairs/export?format=ndjson|csv и фильтры списка /api/repairs.
+
+        Пагинация не применяется; ответ идёт кусками (chunked), память не зависит от размера архива.
+        """
+        params = self.query_params()
+        fmt = params.get("format", "ndjson").lower()
+        try:
+            if fmt not in EXPORT_FORMATS:
+                raise ValueError(f"Неизвестный формат: {fmt}")
+            query = parse_repairs_query({k: v for k, v in params.items() if k not in ("page", "per_page", "limit", "offset")})
+        except ValueError as e:
+            self.send_json_response({"error": f"Неверные параметры: {e}"}, 400)
+            return
+        encoding = self.accepted_encoding(COMPRESS_MIN_SIZE)
+        filename = f"repairs-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+        headers = [('Content-Disposition', f'attachment; filename="{filename}"'), ('Vary', 'Accept-Encoding')]
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        print(f"📤 Выгрузка заявок ({fmt}{', ' + encoding if encoding else ''})")
+        self.send_stream(export_chunks(iter_repairs(query), fmt, encoding), EXPORT_FORMATS[fmt][0], headers)
+
     def send_repair_by_id(self, repair_id):
         """Получение конкретной заявки"""
         try:
-            repair = next((r for r in REPAIRS_STORAGE if r['id'] == repair_id), None)
+            repair = copy_record("repairs", repair_id)
             if repair:
                 self.send_json_response(repair)
             else:
@@ -491,37 +2801,40 @@ class ProductionHandler(BaseHTTPRequestHandler):
     def update_repair(self):
         """Полное обновление заявки (кроме id)"""
         try:
-            repair_id = self.path.split('/')[-1]
+            repair_id = self.path_id()
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length <= 0:
                 self.send_json_response({"error": "Нет данных"}, 400)
                 return
             post_data = self.rfile.read(content_length)
             data = json.loads(post_data.decode('utf-8'))
+            if not isinstance(data, dict):
+                self.send_json_response({"error": "Ожидается JSON-объект"}, 400)
+                return
+            # Обновляем только известные поля, проверенные до изменения заявки
+            try:
+                changes = {k: _repair_text(k, v) for k, v in data.items() if k in REPAIR_TEXT_FIELDS}
+                if "status" in changes:
+                    changes["status"] = _repair_status(changes["status"])
+            except ValueError as e:
+                self.send_json_response({"error": str(e)}, 400)
+                return
 
             updated = None
-            with LOCK:
-                for repair in REPAIRS_STORAGE:
-                    if repair.get('id') == repair_id:
-                        # Обновляем только известные поля
-                        allowed = {
-                            "firstName", "lastName", "phone", "email",
-                            "deviceType", "deviceBrand", "problemType",
-                            "urgency", "address", "description",
-                            "status", "technician"
-                        }
-                        for k, v in data.items():
-                            if k in allowed:
-                                repair[k] = v
-                        repair["updated_at"] = datetime.now().isoformat()
-                        updated = repair
-                        break
+            with LOCKS["repairs"]:
+                repair = REPAIRS_INDEX.get(repair_id)
+                if repair:
+                    _unindex_repair(dict(repair))
+                    repair.update(changes)
+                    repair["updated_at"] = datetime.now().isoformat()
+                    _index_repair(repair)
+                    record_change("repairs", "put", repair)
+                    updated = dict(repair)
 
             if not updated:
                 self.send_json_response({"error": "Заявка не найдена"}, 404)
                 return
 
-            save_repairs()
             upsert_customer_from_repair(updated)
             self.send_json_response({"status": "success", "item": updated})
         except Exception as e:
@@ -530,22 +2843,20 @@ class ProductionHandler(BaseHTTPRequestHandler):
 
     # -------- Customers API --------
     def send_customers_api(self):
-        self.send_json_response({"items": CUSTOMERS_STORAGE, "total": len(CUSTOMERS_STORAGE), "timestamp": datetime.now().isoformat()})
+        # Сводка по заявкам входит в срез, поэтому ETag зависит и от заявок
+        snap = snapshot("customers")
+        if self.not_modified(snap.etag):
+            return
+        self.send_cached_json(snap.etag, ("customers", "repairs"), lambda: {
+            "items": snap.items, "total": len(snap.items), "timestamp": snap.changed_at})
 
     def send_customer_by_id(self, customer_id):
-        customer = next((c for c in CUSTOMERS_STORAGE if c.get("id") == customer_id), None)
-        if not customer:
+        with LOCKS["repairs"], LOCKS["customers"]:
+            customer = CUSTOMERS_INDEX.get(customer_id)
+            payload = dict(customer, **customer_repairs_summary(customer)) if customer else None
+        if not payload:
             self.send_json_response({"error": "Клиент не найден"}, 404)
             return
-        # считаем количество заявок по ключу
-        key = _customer_key(customer.get("phone"), customer.get("email"))
-        repairs_count = 0
-        if key:
-            for r in REPAIRS_STORAGE:
-                if _customer_key(r.get("phone"), r.get("email")) == key:
-                    repairs_count += 1
-        payload = dict(customer)
-        payload["repairs_count"] = repairs_count
         self.send_json_response(payload)
 
     def create_customer(self):
@@ -565,59 +2876,177 @@ class ProductionHandler(BaseHTTPRequestHandler):
                 "created_at": datetime.now().isoformat(),
                 "updated_at": datetime.now().isoformat(),
             }
-            with LOCK:
-                CUSTOMERS_STORAGE.insert(0, item)
-            save_customers()
+            with LOCKS["customers"]:
+                CUSTOMERS_STORAGE.insert(item)
+                _index_customer(item)
+                SEARCH_INDEX.index("customer", item)
+                record_change("customers", "put", item, "create")
+                item = dict(item)
             self.send_json_response({"status": "success", "item": item})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
+    def create_customers_batch(self):
+        """Пакетное создание клиентов; клиент с тем же телефоном/email обновляется, а не дублируется"""
+        try:
+            items = self.read_batch()
+            if items is None:
+                return
+            results = [None] * len(items)
+            valid = []
+            for i, data in enumerate(items):
+                if isinstance(data, Exception) or not isinstance(data, dict):
+                    error = str(data) if isinstance(data, Exception) else "Ожидается JSON-объект"
+                elif not any(str(data.get(f) or "").strip() for f in CUSTOMER_CONTACT_FIELDS):
+                    error = "Нужно имя, телефон или email"
+                else:
+                    valid.append((i, data))
+                    continue
+                results[i] = {"index": i, "status": "error", "error": error}
+            if valid:
+                upserted = upsert_customers([d for _, d in valid], CUSTOMER_CONTACT_FIELDS + ("note",))
+                for (i, _), (customer, event) in zip(valid, upserted):
+                    results[i] = {"index": i, "status": "created" if event == "create" else "updated",
+                                  "id": customer["id"]}
+            self.send_batch_results(results, "клиентов")
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
     def update_customer(self):
         try:
-            customer_id = self.path.split('/')[-1]
+            customer_id = self.path_id()
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length <= 0:
                 self.send_json_response({"error": "Нет данных"}, 400)
                 return
             data = json.loads(self.rfile.read(content_length).decode('utf-8'))
             updated = None
-            with LOCK:
-                for c in CUSTOMERS_STORAGE:
-                    if c.get("id") == customer_id:
-                        for k in ("firstName", "lastName", "phone", "email", "note"):
-                            if k in data:
-                                c[k] = data.get(k, "")
-                        c["updated_at"] = datetime.now().isoformat()
-                        updated = c
-                        break
+            with LOCKS["customers"]:
+                c = CUSTOMERS_INDEX.get(customer_id)
+                if c:
+                    old_key = _customer_key(c.get("phone"), c.get("email"))
+                    for k in ("firstName", "lastName", "phone", "email", "note"):
+                        if k in data:
+                            c[k] = data.get(k, "")
+                    c["updated_at"] = datetime.now().isoformat()
+                    if _customer_key(c.get("phone"), c.get("email")) != old_key:
+                        _unindex_customer(c, old_key)
+                        _index_customer(c)
+                    SEARCH_INDEX.index("customer", c)
+                    record_change("customers", "put", c)
+                    updated = dict(c)
             if not updated:
                 self.send_json_response({"error": "Клиент не найден"}, 404)
                 return
-            save_customers()
             self.send_json_response({"status": "success", "item": updated})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     def delete_customer(self):
         try:
-            customer_id = self.path.split('/')[-1]
-            with LOCK:
-                before = len(CUSTOMERS_STORAGE)
-                CUSTOMERS_STORAGE[:] = [c for c in CUSTOMERS_STORAGE if c.get("id") != customer_id]
-            if len(CUSTOMERS_STORAGE) == before:
+            customer_id = self.path_id()
+            with LOCKS["customers"]:
+                removed = CUSTOMERS_STORAGE.remove(customer_id)
+                if removed:
+                    _unindex_customer(removed, _customer_key(removed.get("phone"), removed.get("email")))
+                    SEARCH_INDEX.remove("customer", removed.get("id"))
+                    record_change("customers", "del", removed)
+            if not removed:
                 self.send_json_response({"error": "Клиент не найден"}, 404)
                 return
-            save_customers()
             self.send_json_response({"status": "success"})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
+    # -------- Events API (SSE) --------
+    def send_event_stream(self):
+        """Поток изменений: GET /api/events?collections=repairs,customers (Last-Event-ID для дочитывания)"""
+        params = self.query_params()
+        collections = {c.strip() for c in params.get('collections', '').split(',') if c.strip()} or None
+        last_event_id = self.headers.get('Last-Event-ID') or params.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        subscriber = EVENTS.subscribe(collections, last_event_id, self.event_stream_limit)
+        if subscriber is None:
+            self.send_json_response({"error": "Слишком много подключений к потоку событий, используйте опрос"}, 503)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.start_event_stream(subscriber)
+
+    # Поток на каждого подписчика — поэтому их число ограничено
+    event_stream_limit = EVENTS_MAX_CLIENTS
+
+    def start_event_stream(self, subscriber):
+        """Передаёт соединение отдельному потоку, чтобы подписчик не занимал обработчик"""
+        self.wfile.flush()
+        self.server.detach_request(self.request)
+        threading.Thread(target=_pump_events, args=(self.request, subscriber),
+                         name="sse-client", daemon=True).start()
+
+    # -------- Changes API --------
+    def send_changes_api(self):
+        """Дельта-синхронизация: GET /api/changes?since=<seq>&collections=repairs&limit=1000"""
+        try:
+            params = self.query_params()
+            since = int(params.get("since", 0))
+            limit = max(1, min(int(params.get("limit", DEFAULT_CHANGES_LIMIT)), MAX_CHANGES_LIMIT))
+            collections = {c.strip() for c in params.get('collections', '').split(',') if c.strip()} or None
+            unknown = (collections or set()) - set(COLLECTIONS)
+            if unknown:
+                raise ValueError(f"неизвестные коллекции: {', '.join(sorted(unknown))}")
+            self.send_json_response(changes_since(since, collections, limit))
+        except ValueError as e:
+            self.send_json_response({"error": f"Неверные параметры: {e}"}, 400)
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
+    # -------- Search API --------
+    def send_search_api(self):
+        """Полнотекстовый поиск по заявкам и клиентам: ?q=...&type=repairs|customers&limit=20"""
+        try:
+            params = self.query_params()
+            q = params.get("q", "").strip()
+            if not q:
+                self.send_json_response({"error": "Пустой запрос"}, 400)
+                return
+            kinds = {"repairs": ("repair",), "customers": ("customer",)}.get(params.get("type"))
+            limit = max(1, min(int(params.get("limit", 20)), 100))
+            build_search_index()
+            started = time.perf_counter()
+            items = []
+            for (kind, doc_id), score in SEARCH_INDEX.search(q, kinds, limit):
+                record = copy_record("repairs" if kind == "repair" else "customers", doc_id)
+                if record:
+                    items.append({"type": kind, "id": doc_id, "score": round(score, 2), "item": record})
+            self.send_json_response({
+                "query": q,
+                "items": items,
+                "total": len(items),
+                "took_ms": round((time.perf_counter() - started) * 1000, 2),
+            })
+        except ValueError as e:
+            self.send_json_response({"error": f"Неверные параметры: {e}"}, 400)
+        except Exception as e:
+            self.send_json_response({"error": str(e)}, 500)
+
     # -------- Inventory API --------
     def send_inventory_api(self):
-        self.send_json_response({"items": INVENTORY_STORAGE, "total": len(INVENTORY_STORAGE), "timestamp": datetime.now().isoformat()})
+        snap = snapshot("inventory")
+        if self.not_modified(snap.etag):
+            return
+        self.send_cached_json(snap.etag, ("inventory",), lambda: {
+            "items": snap.items, "total": len(snap.items), "timestamp": snap.changed_at})
 
     def send_inventory_by_id(self, item_id):
-        item = next((i for i in INVENTORY_STORAGE if i.get("id") == item_id), None)
+        item = copy_record("inventory", item_id)
         if not item:
             self.send_json_response({"error": "Позиция не найдена"}, 404)
             return
@@ -640,59 +3069,63 @@ class ProductionHandler(BaseHTTPRequestHandler):
                 "created_at": datetime.now().isoformat(),
                 "updated_at": datetime.now().isoformat(),
             }
-            with LOCK:
-                INVENTORY_STORAGE.insert(0, item)
-            save_inventory()
+            with LOCKS["inventory"]:
+                INVENTORY_STORAGE.insert(item)
+                record_change("inventory", "put", item, "create")
+                item = dict(item)
             self.send_json_response({"status": "success", "item": item})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     def update_inventory_item(self):
         try:
-            item_id = self.path.split('/')[-1]
+            item_id = self.path_id()
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length <= 0:
                 self.send_json_response({"error": "Нет данных"}, 400)
                 return
             data = json.loads(self.rfile.read(content_length).decode('utf-8'))
             updated = None
-            with LOCK:
-                for i in INVENTORY_STORAGE:
-                    if i.get("id") == item_id:
-                        for k in ("name", "sku", "qty", "min_qty", "location"):
-                            if k in data:
-                                i[k] = data.get(k)
-                        i["updated_at"] = datetime.now().isoformat()
-                        updated = i
-                        break
+            with LOCKS["inventory"]:
+                i = INVENTORY_INDEX.get(item_id)
+                if i:
+                    for k in ("name", "sku", "qty", "min_qty", "location"):
+                        if k in data:
+                            i[k] = data.get(k)
+                    i["updated_at"] = datetime.now().isoformat()
+                    record_change("inventory", "put", i)
+                    updated = dict(i)
             if not updated:
                 self.send_json_response({"error": "Позиция не найдена"}, 404)
                 return
-            save_inventory()
             self.send_json_response({"status": "success", "item": updated})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     def delete_inventory_item(self):
         try:
-            item_id = self.path.split('/')[-1]
-            with LOCK:
-                before = len(INVENTORY_STORAGE)
-                INVENTORY_STORAGE[:] = [i for i in INVENTORY_STORAGE if i.get("id") != item_id]
-            if len(INVENTORY_STORAGE) == before:
+            item_id = self.path_id()
+            with LOCKS["inventory"]:
+                removed = INVENTORY_STORAGE.remove(item_id)
+                if removed:
+                    record_change("inventory", "del", removed)
+            if not removed:
                 self.send_json_response({"error": "Позиция не найдена"}, 404)
                 return
-            save_inventory()
             self.send_json_response({"status": "success"})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     # -------- Appointments API --------
     def send_appointments_api(self):
-        self.send_json_response({"items": APPOINTMENTS_STORAGE, "total": len(APPOINTMENTS_STORAGE), "timestamp": datetime.now().isoformat()})
+        snap = snapshot("appointments")
+        if self.not_modified(snap.etag):
+            return
+        self.send_cached_json(snap.etag, ("appointments",), lambda: {
+            "items": snap.items, "total": len(snap.items), "timestamp": snap.changed_at})
 
     def send_appointment_by_id(self, appt_id):
-        item = next((a for a in APPOINTMENTS_STORAGE if a.get("id") == appt_id), None)
+        item = copy_record("appointments", appt_id)
         if not item:
             self.send_json_response({"error": "Запись не найдена"}, 404)
             return
@@ -716,56 +3149,56 @@ class ProductionHandler(BaseHTTPRequestHandler):
                 "created_at": datetime.now().isoformat(),
                 "updated_at": datetime.now().isoformat(),
             }
-            with LOCK:
-                APPOINTMENTS_STORAGE.insert(0, item)
-            save_appointments()
+            with LOCKS["appointments"]:
+                APPOINTMENTS_STORAGE.insert(item)
+                record_change("appointments", "put", item, "create")
+                item = dict(item)
             self.send_json_response({"status": "success", "item": item})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     def update_appointment(self):
         try:
-            appt_id = self.path.split('/')[-1]
+            appt_id = self.path_id()
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length <= 0:
                 self.send_json_response({"error": "Нет данных"}, 400)
                 return
             data = json.loads(self.rfile.read(content_length).decode('utf-8'))
             updated = None
-            with LOCK:
-                for a in APPOINTMENTS_STORAGE:
-                    if a.get("id") == appt_id:
-                        for k in ("start", "customer", "title", "technician", "status", "note"):
-                            if k in data:
-                                a[k] = data.get(k)
-                        a["updated_at"] = datetime.now().isoformat()
-                        updated = a
-                        break
+            with LOCKS["appointments"]:
+                a = APPOINTMENTS_INDEX.get(appt_id)
+                if a:
+                    for k in ("start", "customer", "title", "technician", "status", "note"):
+                        if k in data:
+                            a[k] = data.get(k)
+                    a["updated_at"] = datetime.now().isoformat()
+                    record_change("appointments", "put", a)
+                    updated = dict(a)
             if not updated:
                 self.send_json_response({"error": "Запись не найдена"}, 404)
                 return
-            save_appointments()
             self.send_json_response({"status": "success", "item": updated})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     def delete_appointment(self):
         try:
-            appt_id = self.path.split('/')[-1]
-            with LOCK:
-                before = len(APPOINTMENTS_STORAGE)
-                APPOINTMENTS_STORAGE[:] = [a for a in APPOINTMENTS_STORAGE if a.get("id") != appt_id]
-            if len(APPOINTMENTS_STORAGE) == before:
+            appt_id = self.path_id()
+            with LOCKS["appointments"]:
+                removed = APPOINTMENTS_STORAGE.remove(appt_id)
+                if removed:
+                    record_change("appointments", "del", removed)
+            if not removed:
                 self.send_json_response({"error": "Запись не найдена"}, 404)
                 return
-            save_appointments()
             self.send_json_response({"status": "success"})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
 
     # -------- Settings API --------
     def send_settings_api(self):
-        self.send_json_response(SETTINGS_STORAGE or {})
+        self.send_json_response(copy_record("settings", None))
 
     def update_settings(self):
         try:
@@ -777,33 +3210,47 @@ class ProductionHandler(BaseHTTPRequestHandler):
             if not isinstance(data, dict):
                 self.send_json_response({"error": "Неверный формат"}, 400)
                 return
-            with LOCK:
+            with LOCKS["settings"]:
                 SETTINGS_STORAGE.update(data)
                 SETTINGS_STORAGE["updated_at"] = datetime.now().isoformat()
-            save_settings()
-            self.send_json_response({"status": "success", "settings": SETTINGS_STORAGE})
+                record_change("settings", "set", SETTINGS_STORAGE)
+                settings = dict(SETTINGS_STORAGE)
+            self.send_json_response({"status": "success", "settings": settings})
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
     
+    def path_id(self, position=-1):
+        """Сегмент пути без query-параметров: id записи в /api/<коллекция>/<id>[/status]"""
+        return urlsplit(self.path).path.split('/')[position]
+
+    def query_params(self):
+        """Параметры строки запроса: имя -> последнее значение"""
+        return {k: v[-1] for k, v in parse_qs(urlsplit(self.path).query).items()}
+
     def send_stats_api(self):
-        """API статистики"""
+        """API статистики (из счётчиков REPAIR_STATS; ?verify=1 — сверка с полным пересчётом)"""
         try:
-            total = len(REPAIRS_STORAGE)
-            new_count = len([r for r in REPAIRS_STORAGE if r['status'] == 'new'])
-            in_progress = len([r for r in REPAIRS_STORAGE if r['status'] == 'in-progress'])
-            completed = len([r for r in REPAIRS_STORAGE if r['status'] == 'completed'])
-            urgent = len([r for r in REPAIRS_STORAGE if r['urgency'] == 'high'])
-            
-            # Заявки за сегодня
-            today = datetime.now().date()
-            today_count = 0
-            for repair in REPAIRS_STORAGE:
-                try:
-                    repair_date = datetime.fromisoformat(repair['timestamp'].replace('Z', '+00:00')).date()
-                    if repair_date == today:
-                        today_count += 1
-                except:
-                    pass
+            verification = None
+            # "Заявки за сегодня" меняются и без изменений данных — в ETag входит дата
+            today = datetime.now().date().isoformat()
+            etag = collections_etag("repairs", extra=today)
+            if self.query_params().get('verify') in ('1', 'true'):
+                drift = verify_repair_stats()
+                verification = {"ok": not drift, "drift": drift}
+                etag = None
+            elif self.not_modified(etag):
+                return
+
+            # Счётчики читаются вместе, чтобы не попасть между изменениями одной заявки
+            with LOCKS["repairs"]:
+                total = len(REPAIRS_STORAGE)
+                new_count = REPAIR_STATS["status"]["new"]
+                in_progress = REPAIR_STATS["status"]["in-progress"]
+                completed = REPAIR_STATS["status"]["completed"]
+                urgent = REPAIR_STATS["urgency"]["high"]
+                
+                # Заявки за сегодня
+                today_count = REPAIR_STATS["day"][today]
             
             stats = {
                 "total_repairs": total,
@@ -812,29 +3259,21 @@ class ProductionHandler(BaseHTTPRequestHandler):
                 "completed_repairs": completed,
                 "urgent_repairs": urgent,
                 "today_repairs": today_count,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": collections_changed_at("repairs")
             }
+            if verification is not None:
+                stats["verification"] = verification
             
-            self.send_json_response(stats)
+            self.send_json_response(stats, etag=etag)
             
         except Exception as e:
             print(f"❌ Ошибка статистики: {e}")
             self.send_json_response({"error": str(e)}, 500)
     
     def send_html_file(self, filename):
-        """Отправка HTML файла"""
+        """Отправка HTML файла (из кэша, с поддержкой 304)"""
         try:
-            if os.path.exists(filename):
-                with open(filename, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/html; charset=utf-8')
-                self.send_header('Cache-Control', 'no-cache')
-                self.end_headers()
-                self.wfile.write(content.encode('utf-8'))
-                
-            else:
+            if not self.send_asset(filename, 'no-cache'):
                 print(f"❌ Файл не найден: {filename}")
                 self.send_fallback_page()
                 
@@ -846,36 +3285,86 @@ class ProductionHandler(BaseHTTPRequestHandler):
         """Отправка статических файлов"""
         try:
             filename = path[1:]  # Убираем ведущий /
-            if os.path.exists(filename):
-                with open(filename, 'rb') as f:
-                    content = f.read()
-                
-                # Определяем MIME тип
-                if filename.endswith('.css'):
-                    content_type = 'text/css'
-                elif filename.endswith('.js'):
-                    content_type = 'application/javascript'
-                elif filename.endswith('.png'):
-                    content_type = 'image/png'
-                elif filename.endswith('.jpg') or filename.endswith('.jpeg'):
-                    content_type = 'image/jpeg'
-                elif filename.endswith('.svg'):
-                    content_type = 'image/svg+xml'
-                else:
-                    content_type = 'application/octet-stream'
-                
-                self.send_response(200)
-                self.send_header('Content-Type', content_type)
-                self.send_header('Cache-Control', 'public, max-age=3600')
-                self.end_headers()
-                self.wfile.write(content)
-            else:
+            if not self.send_asset(filename, 'public, max-age=3600'):
                 self.send_json_response({"error": "Static file not found"}, 404)
                 
         except Exception as e:
             print(f"❌ Ошибка статического файла {path}: {e}")
             self.send_json_response({"error": str(e)}, 500)
+
+    def send_asset(self, filename, cache_control):
+        """Отдаёт файл через ASSETS; False — файла нет"""
+        asset = ASSETS.get(filename)
+        if asset is None:
+            return False
+        use_gzip = asset.gzip_body is not None and self.accepted_encoding(asset.size) == 'gzip'
+        etag = asset.etag[:-1] + '-gzip"' if use_gzip else asset.etag
+        if self.not_modified(asset.etag, cache_control):
+            return True
+        since = self.headers.get('If-Modified-Since')
+        if since and not self.headers.get('If-None-Match') and since == asset.last_modified:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return True
+
+        body = asset.gzip_body if use_gzip else asset.body
+        self.send_response(200)
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', asset.last_modified)
+        if asset.gzip_body is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body) if body is not None else asset.size))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+        else:
+            self.send_file_body(asset)
+        return True
+
+    def send_file_body(self, asset):
+        """Тело большого файла напрямую из файла в сокет"""
+        self.wfile.flush()
+        with open(asset.path, 'rb') as f:
+            self.connection.sendfile(f, 0, asset.size)
     
+    def send_stream(self, chunks, content_type, headers=()):
+        """Отправляет тело кусками по мере готовности.
+
+        Клиенту HTTP/1.1 — Transfer-Encoding: chunked, HTTP/1.0 — до закрытия соединения.
+        """
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            # chunked есть только в HTTP/1.1; соединение после выгрузки всё равно закрывается
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for keyword, value in headers:
+            self.send_header(keyword, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            print("⚠️ Клиент закрыл соединение во время выгрузки")
+        except Exception as e:
+            # заголовки уже отправлены: без завершающего куска клиент увидит обрыв, а не неполный файл
+            print(f"❌ Ошибка выгрузки: {e}")
+        finally:
+            chunks.close()
+
     def send_fallback_page(self):
         """Fallback страница если основные файлы не найдены"""
         html = """<!DOCTYPE html>
@@ -935,21 +3424,565 @@ class ProductionHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(html.encode('utf-8'))
     
-    def send_json_response(self, data, status=200):
-        """Отправка JSON ответа"""
+    def not_modified(self, etag, cache_control='no-cache'):
+        """Отвечает 304, если If-None-Match клиента совпадает с etag (в любом варианте представления)"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        matched = None
+        for tag in (t.strip() for t in header.split(',')):
+            if tag == '*':
+                matched = etag
+                break
+            variant = tag[2:] if tag.startswith('W/') else tag
+            base = variant
+            for suffix in ('-gzip"', '-deflate"', '-pretty"'):
+                if base.endswith(suffix):
+                    base = base[:-len(suffix)] + '"'
+            if base == etag:
+                matched = variant
+                break
+        if matched is None:
+            return False
+        self.send_response(304)
+        self.send_header('ETag', matched)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return True
+
+    def accepted_encoding(self, size):
+        """gzip или deflate, если клиент их принимает и тело не меньше COMPRESS_MIN_SIZE"""
+        if size < COMPRESS_MIN_SIZE or COMPRESS_LEVEL <= 0:
+            return None
+        accepted = {}
+        for part in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = part.strip().lower().partition(';')
+            q = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    q = float(params.strip()[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[name.strip()] = q
+        for encoding in ('gzip', 'deflate'):
+            if accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return None
+
+    def encode_json_response(self, data, etag=None):
+        """Компактный JSON (?pretty=1 — с отступами), сжатый по Accept-Encoding: (body, encoding, etag)"""
+        pretty = self.query_params().get('pretty') in ('1', 'true')
+        if pretty:
+            response = json.dumps(data, ensure_ascii=False, indent=2)
+        else:
+            response = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        body = response.encode('utf-8')
+        encoding = self.accepted_encoding(len(body))
+        if encoding:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, COMPRESS_WBITS[encoding])
+            body = compressor.compress(body) + compressor.flush()
+        if etag:
+            # У каждого варианта представления свой сильный ETag
+            suffixes = "".join(f"-{v}" for v in ("pretty" if pretty else None, encoding) if v)
+            etag = etag[:-1] + suffixes + '"'
+        return body, encoding, etag
+
+    def send_cached_json(self, etag, collections, build):
+        """Ответ списка из RESPONSE_CACHE; при промахе build() сериализуется и кладётся в кэш"""
+        if RESPONSE_CACHE.max_bytes <= 0:
+            self.send_json_response(build(), etag=etag)
+            return
+        split = urlsplit(self.path)
+        key = (split.path, tuple(sorted(self.query_params().items())), self.accepted_encoding(COMPRESS_MIN_SIZE))
+        response = RESPONSE_CACHE.get(key, etag)
+        if response is None:
+            response = self.encode_json_response(build(), etag)
+            RESPONSE_CACHE.put(key, etag, collections, response)
+        self.write_json_body(*response)
+
+    def send_json_response(self, data, status=200, etag=None):
+        """Отправка JSON ответа (?durable=1 у изменяющего запроса — после записи на диск)"""
+        try:
+            if self.command in ('POST', 'PUT', 'DELETE') and self.query_params().get('durable') in ('1', 'true'):
+                if not (PERSISTER.flush() and STORAGE.sync()) and status < 400:
+                    data, status = {"error": "Изменение применено, но не сохранено на диск"}, 500
+            body, encoding, etag = self.encode_json_response(data, etag)
+            self.write_json_body(body, encoding, etag, status)
+        except Exception as e:
+            print(f"❌ Ошибка JSON ответа: {e}")
+
+    def write_json_body(self, body, encoding=None, etag=None, status=200):
+        """Отправка готового (сериализованного) тела JSON ответа"""
         try:
             self.send_response(status)
             self.send_header('Content-Type', 'application/json; charset=utf-8')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            if etag:
+                self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            
-            response = json.dumps(data, ensure_ascii=False, indent=2)
-            self.wfile.write(response.encode('utf-8'))
+            self.wfile.write(body)
             
         except Exception as e:
             print(f"❌ Ошибка JSON ответа: {e}")
 
+class StreamingHTTPServer(HTTPServer):
+    """HTTPServer, у которого обработчик может забрать соединение себе (поток /api/events)"""
+
+    def __init__(self, *args, **kwargs):
+        self.detached = set()
+        self.detached_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def detach_request(self, request):
+        with self.detached_lock:
+            self.detached.add(request)
+
+    def shutdown_request(self, request):
+        with self.detached_lock:
+            if request in self.detached:
+                self.detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+
+class PooledHTTPServer(StreamingHTTPServer):
+    """HTTPServer с ограниченным пулом рабочих потоков и очередью соединений"""
+
+    def __init__(self, server_address, handler_class, workers=8, queue_size=64, request_timeout=30):
+        self.request_timeout = request_timeout
+        self.pending = queue.Queue(maxsize=max(1, queue_size))
+        self.workers = []
+        super().__init__(server_address, handler_class)
+        for n in range(max(1, workers)):
+            t = threading.Thread(target=self._worker_loop, name=f"http-worker-{n}", daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def process_request(self, request, client_address):
+        """Ставит соединение в очередь; при переполнении сразу отвечает 503"""
+        # Медленный клиент не должен навсегда занимать рабочий поток
+        request.settimeout(self.request_timeout)
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def _worker_loop(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                break
+            request, client_address = job
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def reject_request(self, request, client_address):
+        """Отказ при перегрузке: 503 без постановки в очередь"""
+        body = json.dumps({"error": "Сервер перегружен, повторите запрос позже"}, ensure_ascii=False).encode('utf-8')
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Retry-After: 1\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('ascii')
+        try:
+            request.sendall(head + body)
+        except OSError:
+            pass
+        print(f"⚠️ Очередь запросов заполнена, отказ {client_address[0]}")
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            try:
+                self.pending.put(None, timeout=1)
+            except queue.Full:
+                break
+
+
+class BridgeHandler(ProductionHandler):
+    """ProductionHandler без сокета: ответ собирается в память для асинхронного движка"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, command, path, headers, body, client_address, server, version='HTTP/1.1'):
+        # BaseHTTPRequestHandler.__init__ не вызываем — он сам читает сокет
+        self.command = command
+        self.path = path
+        self.headers = headers
+        self.request_version = version
+        self.requestline = f"{command} {path} {version}"
+        self.rfile = io.BytesIO(body)
+        self.wfile = io.BytesIO()
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = False
+        self.status_code = 200
+        self.reason = 'OK'
+        self.response_headers = []
+        self.event_subscriber = None
+        self.stream_chunks = None
+        self.stream_chunked = False
+        self.stream_file = None
+        self.request_body = None
+
+    def send_response(self, code, message=None):
+        self.log_request(code)
+        self.status_code = code
+        self.reason = message or self.responses.get(code, ('',))[0]
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection':
+            self.close_connection = value.lower() == 'close'
+            return
+        if keyword.lower() == 'content-length':
+            return
+        self.response_headers.append((keyword, value))
+
+    def end_headers(self):
+        pass
+
+    def send_file_body(self, asset):
+        # Тело большого файла в память не читается: его отдаёт асинхронный движок после заголовков
+        self.stream_file = asset
+
+    # Подписчики не занимают потоков, их число не ограничивается
+    event_stream_limit = None
+
+    def start_event_stream(self, subscriber):
+        # События отдаёт сам асинхронный движок, не занимая рабочий поток
+        self.event_subscriber = subscriber
+        self.close_connection = True
+
+    def open_request_body(self):
+        # Потоковое тело подставляет асинхронный движок, остальные уже прочитаны в rfile
+        return self.request_body or SocketRequestBody(self.rfile, self.headers)
+
+    def send_stream(self, chunks, content_type, headers=()):
+        # Куски забирает асинхронный движок после заголовков. HTTP/1.1 — chunked и keep-alive,
+        # HTTP/1.0 chunked не знает: тело идёт до закрытия соединения, как в потоковых режимах
+        self.stream_chunked = self.request_version == 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for keyword, value in headers:
+            self.send_header(keyword, value)
+        if self.stream_chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        self.stream_chunks = chunks
+
+    def dispatch(self):
+        """Вызывает do_<METHOD> и возвращает готовый ответ в байтах (HTTP/1.0 клиенту — HTTP/1.0)"""
+        method = getattr(self, 'do_' + self.command, None)
+        if method is None:
+            self.send_error(501, f"Unsupported method ({self.command!r})")
+        else:
+            method()
+        body = self.wfile.getvalue()
+        version = self.protocol_version if self.request_version == 'HTTP/1.1' else 'HTTP/1.0'
+        lines = [f"{version} {self.status_code} {self.reason}",
+                 f"Server: {self.version_string()}",
+                 f"Date: {formatdate(usegmt=True)}"]
+        lines += [f"{k}: {v}" for k, v in self.response_headers]
+        if self.stream_file is not None:
+            lines.append(f"Content-Length: {self.stream_file.size}")
+        elif self.event_subscriber is None and self.stream_chunks is None:
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("Connection: close" if self.close_connection else "Connection: keep-alive")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1', 'strict')
+        return head + body
+
+
+class AsyncRequestBody(RequestBody):
+    """Тело запроса из asyncio-потока для обработчика в рабочем потоке: чтение идёт в цикле событий"""
+
+    def __init__(self, reader, loop, headers):
+        super().__init__(headers)
+        self.reader = reader
+        self.loop = loop
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _read(self, size):
+        return self._call(self.reader.read(size) if not self.chunked else self.reader.readexactly(size))
+
+    def _readline(self):
+        return self._call(self.reader.readline())
+
+
+class AsyncHTTPServer:
+    """Асинхронный движок на asyncio: HTTP/1.1 keep-alive, соединения без потока на сокет.
+
+    Маршрутизация та же, что у ProductionHandler; обработчики выполняются в пуле потоков,
+    поэтому простаивающие вкладки админки не занимают ни одного потока.
+    """
+
+    max_header_size = 64 * 1024
+    max_body_size = 16 * 1024 * 1024
+
+    def __init__(self, server_address, handler_class=BridgeHandler, workers=8, keepalive_timeout=65,
+                 shutdown_timeout=10):
+        self.server_address = server_address
+        self.handler_class = handler_class
+        self.keepalive_timeout = keepalive_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='async-worker')
+        self.connections = 0
+        # задачи соединений; среди них — ждущие следующего запроса keep-alive
+        self.tasks = set()
+        self.idle = set()
+        self.stopping = None
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def server_close(self):
+        self.executor.shutdown(wait=False)
+
+    async def _serve(self):
+        host, port = self.server_address
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, host, port, limit=self.max_header_size)
+        # исключение из обработчика сигнала main() оборвало бы соединения посреди ответа,
+        # поэтому SIGTERM останавливает сервер из цикла событий (finally в main() сохранит данные)
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+        try:
+            await self.stopping.wait()
+        finally:
+            server.close()
+        await self._close_connections()
+
+    def _stop(self):
+        print("\n🛑 Получен SIGTERM, сервер останавливается")
+        self.stopping.set()
+
+    async def _close_connections(self):
+        """Остановка: потоки событий закрываются, простаивающие keep-alive соединения рвутся,
+        начатые запросы дорабатывают не дольше shutdown_timeout секунд"""
+        EVENTS.close_all()
+        for task in self.idle:
+            task.cancel()
+        if not self.tasks:
+            return
+        _, pending = await asyncio.wait(set(self.tasks), timeout=self.shutdown_timeout)
+        if pending:
+            print(f"⚠️ Соединений, не завершившихся за {self.shutdown_timeout:g} с: {len(pending)} — закрыты")
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+
+    async def _read_body(self, reader, headers):
+        if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            size = 0
+            while True:
+                line = await reader.readline()
+                chunk_size = int(line.split(b';', 1)[0].strip() or b'0', 16)
+                if chunk_size == 0:
+                    # trailer-заголовки до пустой строки
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                size += chunk_size
+                if size > self.max_body_size:
+                    raise ValueError("Тело запроса слишком большое")
+                chunks.append(await reader.readexactly(chunk_size))
+                await reader.readline()
+        length = int(headers.get('Content-Length', 0) or 0)
+        if length > self.max_body_size:
+            raise ValueError("Тело запроса слишком большое")
+        return await reader.readexactly(length) if length > 0 else b''
+
+    async def _handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        client_address = writer.get_extra_info('peername') or ('', 0)
+        task = asyncio.current_task()
+        self.connections += 1
+        self.tasks.add(task)
+        try:
+            while not self.stopping.is_set():
+                self.idle.add(task)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(b"HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+                finally:
+                    self.idle.discard(task)
+
+                request_line, _, header_block = head.partition(b'\r\n')
+                try:
+                    command, path, version = request_line.decode('latin-1').split()
+                    headers = http.client.parse_headers(io.BytesIO(header_block))
+                    streaming = command == 'POST' and path.split('?')[0] in self.handler_class.STREAMING_UPLOADS
+                    body = b'' if streaming else await self._read_body(reader, headers)
+                    if 'Transfer-Encoding' in headers and not streaming:
+                        # обработчики читают тело по Content-Length
+                        del headers['Transfer-Encoding']
+                        del headers['Content-Length']
+                        headers['Content-Length'] = str(len(body))
+                except (ValueError, asyncio.IncompleteReadError, http.client.HTTPException):
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    break
+
+                handler = self.handler_class(command, path, headers, body, client_address, self, version)
+                if streaming:
+                    handler.request_body = AsyncRequestBody(reader, loop, headers)
+                conn_header = headers.get('Connection', '').lower()
+                if version == 'HTTP/1.0':
+                    handler.close_connection = conn_header != 'keep-alive'
+                else:
+                    handler.close_connection = conn_header == 'close'
+
+                response = await loop.run_in_executor(self.executor, handler.dispatch)
+                writer.write(response)
+                await writer.drain()
+                if handler.event_subscriber is not None:
+                    if self.stopping.is_set():
+                        # подписка появилась уже после EVENTS.close_all()
+                        handler.event_subscriber.close()
+                    await self._pump_events(writer, handler.event_subscriber)
+                    break
+                if handler.stream_chunks is not None and not await self._pump_stream(
+                        writer, handler.stream_chunks, handler.stream_chunked):
+                    break
+                if handler.stream_file is not None and not await self._send_file(writer, handler.stream_file):
+                    break
+                if handler.close_connection or (handler.request_body and not handler.request_body.finished):
+                    break
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # соединение закрыто остановкой сервера; отмену, вышедшую из задачи соединения,
+            # asyncio 3.11 печатает как необработанную ошибку
+            pass
+        finally:
+            self.connections -= 1
+            self.tasks.discard(task)
+            writer.close()
+
+
+    async def _pump_stream(self, writer, chunks, chunked=True):
+        """Отдаёт куски тела (chunked или до закрытия); куски готовятся в пуле потоков, а drain() держит темп клиента.
+
+        False — выгрузка оборвалась, соединение нужно закрыть.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                if chunk is None:
+                    break
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            return True
+        except ConnectionError:
+            raise
+        except Exception as e:
+            print(f"❌ Ошибка выгрузки: {e}")
+            return False
+        finally:
+            await loop.run_in_executor(self.executor, chunks.close)
+
+    async def _send_file(self, writer, asset):
+        """Тело файла через loop.sendfile: os.sendfile, если транспорт его поддерживает, иначе чтение кусками в пуле.
+
+        False — файл отдан не целиком (Content-Length уже отправлен), соединение нужно закрыть.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            with open(asset.path, 'rb') as f:
+                sent = await loop.sendfile(writer.transport, f, 0, asset.size)
+            return sent == asset.size
+        except ConnectionError:
+            raise
+        except OSError as e:
+            print(f"❌ Ошибка отправки файла {asset.path}: {e}")
+            return False
+
+    async def _pump_events(self, writer, subscriber):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        subscriber.wakeup = lambda: loop.call_soon_threadsafe(ready.set)
+        try:
+            writer.write(SSE_RETRY)
+            ready.set()
+            while True:
+                timed_out = False
+                try:
+                    await asyncio.wait_for(ready.wait(), EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                ready.clear()
+                frames = subscriber.drain()
+                if frames is None:
+                    break
+                if frames:
+                    writer.write(b"".join(frames))
+                elif timed_out:
+                    writer.write(SSE_HEARTBEAT)
+                else:
+                    continue
+                await writer.drain()
+        finally:
+            EVENTS.unsubscribe(subscriber)
+
+
+def create_server(host, port):
+    """Создаёт HTTP сервер в режиме SERVER_MODE: single (один поток), pool (пул потоков) или async"""
+    mode = os.environ.get('SERVER_MODE', 'single').strip().lower()
+    if mode == 'async':
+        workers = int(os.environ.get('WORKERS', 8))
+        keepalive_timeout = float(os.environ.get('KEEPALIVE_TIMEOUT', 65))
+        shutdown_timeout = float(os.environ.get('SHUTDOWN_TIMEOUT', 10))
+        print(f"🧵 Режим: asyncio, keep-alive {keepalive_timeout:g} с (workers={workers})")
+        return AsyncHTTPServer((host, port), BridgeHandler, workers=workers, keepalive_timeout=keepalive_timeout,
+                               shutdown_timeout=shutdown_timeout)
+    if mode == 'pool':
+        workers = int(os.environ.get('WORKERS', 8))
+        queue_size = int(os.environ.get('QUEUE_SIZE', 64))
+        request_timeout = float(os.environ.get('REQUEST_TIMEOUT', 30))
+        print(f"🧵 Режим: пул потоков (workers={workers}, queue={queue_size})")
+        return PooledHTTPServer((host, port), ProductionHandler, workers=workers,
+                                queue_size=queue_size, request_timeout=request_timeout)
+    if mode != 'single':
+        print(f"⚠️ Неизвестный SERVER_MODE={mode!r}, используется single")
+    print("🧵 Режим: однопоточный")
+    return StreamingHTTPServer((host, port), ProductionHandler)
+
+
+def _stop_on_sigterm(signum, frame):
+    """SIGTERM (остановка dyno по Procfile, systemd) завершает сервер так же, как Ctrl+C"""
+    print("\n🛑 Получен SIGTERM, сервер останавливается")
+    raise SystemExit(0)
+
+
 def main():
     # Настройки сервера
     PORT = int(os.environ.get('PORT', 8001))  # Поддержка переменной окружения для деплоя
@@ -959,14 +3992,23 @@ def main():
     print("=" * 50)
     print(f"🌐 Хост: {HOST}")
     print(f"🔌 Порт: {PORT}")
-    print(f"📂 Файл данных: {DATA_FILE}")
+    print(f"📂 Хранилище: {STORAGE.describe()}")
     print("=" * 50)
     
-    # Загружаем данные при запуске
-    load_repairs()
+    # Загружаем данные: до открытия порта только в режиме eager, иначе в фоне или по первому запросу
+    # Поисковый индекс строится в фоне во всех режимах, кроме lazy (там — по первому поиску)
+    if COLLECTIONS_LOAD == 'eager':
+        load_all()
+        threading.Thread(target=build_search_index, name="search-index", daemon=True).start()
+    elif COLLECTIONS_LOAD != 'lazy':
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    start_journal_checkpointer()
+    PERSISTER.start()
+    # без обработчика SIGTERM убивает процесс сразу и finally ниже не сохранит отложенные записи
+    signal.signal(signal.SIGTERM, _stop_on_sigterm)
     
     try:
-        server = HTTPServer((HOST, PORT), ProductionHandler)
+        server = create_server(HOST, PORT)
         print(f"✅ Сервер запущен на {HOST}:{PORT}")
         print("📱 Доступные URL:")
         print(f"   • Главная: http://{HOST}:{PORT}")
@@ -991,12 +4033,9 @@ def main():
         import traceback
         traceback.print_exc()
     finally:
-        # Сохраняем данные при завершении
-        save_repairs()
-        save_customers()
-        save_inventory()
-        save_appointments()
-        save_settings()
+        # Сохраняем данные при завершении (в журнальном режиме это и есть чекпоинт)
+        PERSISTER.flush()
+        checkpoint_all()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
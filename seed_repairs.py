@@ -5,6 +5,8 @@ Seed script: создаёт N тестовых заявок через API produ
 
 Запуск:
   python seed_repairs.py --count 30 --base-url http://127.0.0.1:8001
+  python seed_repairs.py --count 10000 --batch-size 1000   # пакетами через /api/repairs/batch
+  python seed_repairs.py --count 30 --batch-size 0         # по одной заявке через /api/repairs
 """
 
 from __future__ import annotations
@@ -140,23 +142,47 @@ def rand_status() -> str:
     return "cancelled"
 
 
-def post_json(url: str, payload: dict) -> dict:
+def post_json(url: str, payload, timeout: float = 10) -> dict:
     data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
     req = Request(url, data=data, method="POST")
     req.add_header("Content-Type", "application/json")
-    with urlopen(req, timeout=10) as resp:
+    with urlopen(req, timeout=timeout) as resp:
         raw = resp.read().decode("utf-8")
         return json.loads(raw) if raw else {}
 
 
+def post_batch(url: str, batch: list, done: int, count: int) -> int:
+    """Отправляет пакет заявок, печатает ошибки по элементам, возвращает число созданных"""
+    try:
+        result = post_json(url, batch, timeout=120)
+    except HTTPError as e:
+        try:
+            result = json.loads(e.read().decode("utf-8"))
+        except Exception:
+            print(f"[{done}/{count}] HTTPError: {e.code} {e.reason}", file=sys.stderr)
+            return 0
+    except URLError as e:
+        print(f"[{done}/{count}] URLError: {e.reason}", file=sys.stderr)
+        return 0
+    except Exception as e:
+        print(f"[{done}/{count}] Error: {e}", file=sys.stderr)
+        return 0
+    for item in result.get("results", []):
+        if item.get("status") == "error":
+            print(f"[{done - len(batch) + item['index'] + 1}/{count}] Error: {item.get('error')}", file=sys.stderr)
+    return result.get("succeeded", 0)
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument("--count", type=int, default=30)
     parser.add_argument("--base-url", type=str, default="http://127.0.0.1:8001")
+    parser.add_argument("--batch-size", type=int, default=500, help="заявок в одном POST /api/repairs/batch; 0 — по одной")
     args = parser.parse_args()
 
     target = args.base_url.rstrip("/") + "/api/repairs"
     ok = 0
+    batch = []
     for i in range(args.count):
         first = random.choice(FIRST_NAMES)
         last = random.choice(LAST_NAMES)
@@ -183,6 +209,14 @@ def main() -> int:
             "source": "seed_repairs.py",
         }
 
+        if args.batch_size > 0:
+            batch.append(payload)
+            if len(batch) < args.batch_size and i + 1 < args.count:
+                continue
+            ok += post_batch(target + "/batch", batch, i + 1, args.count)
+            batch = []
+            continue
+
         try:
             post_json(target, payload)
             ok += 1